@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the plume and dosimetry hot paths: multi_plume(),
+single_plume(), buildup_factor(), gamma_factors(), time_resolved_H10_many(),
+read_lara() and read_selenium_meteo().
+
+All inputs are synthetic (grids, meteo series, source, LARA sheets and mast
+CSV archives written to a temporary directory), so the suite runs offline
+and never touches data/. Every case is timed over a number of repeats (best
+and median run time) and run once more under tracemalloc for its peak
+memory, which includes the numpy arrays.
+
+Grid sizes:
+    small   : 21x21x6 over 500x500x200 m
+    default : 101x101x21 over 500x500x200 m, as in selenium-75.py
+    large   : 201x201x41 over 1000x1000x400 m
+Meteo lengths:
+    short   : 6 timesteps of 10 minutes, as in selenium-75.py
+    long    : 144 timesteps, a day
+
+Usage:
+    python benchmarks.py --output bench.json
+    python benchmarks.py --sizes default large --lengths long
+    python benchmarks.py --compare bench.json
+
+With --compare, cases that are slower or use more memory than in the
+baseline by more than the tolerances are reported and the exit status is 1.
+Cases whose concentration array would exceed --max-memory are skipped.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import kernel_cache
+import meteo_store
+import nuclide_library
+from gamma_dosimetry import buildup_factor, gamma_factors, time_resolved_H10_many
+from gaussian_plume import multi_plume, plume_inputs, single_plume
+from mathematical_tools import create_square_centered_grid, instance_of_data_collection
+from read_inputs import read_lara, read_selenium_meteo
+
+grid_sizes = {'small':   (500, 500, 200, 21, 21, 6),
+              'default': (500, 500, 200, 101, 101, 21),
+              'large':   (1000, 1000, 400, 201, 201, 41)}
+meteo_lengths = {'short': 6, 'long': 144}
+
+# Se-75 gamma lines above 50 keV, from data/nuclides/Se-75.lara.txt
+Se75_Ey = np.array([264.6576, 136.0001, 279.5422, 121.1155, 400.6572, 96.7340, 198.6060, 303.9236, 66.0518])
+Se75_I = np.array([0.5875, 0.577, 0.2489, 0.1686, 0.11388, 0.0335, 0.0146, 0.01308, 0.01085])
+
+# detectors IMR/M03, IMR/M15 and IMR/M04 of selenium-75.py
+xq = np.array([-157.2, -262.2, -305.8])
+yq = np.array([-142.8, -121.6, 44.9])
+zq = np.array([1., 1., 1.])
+rho = 0.001161
+database = 'nucl'
+
+def synthetic_meteo(Nt,seed=0):
+    """Meteo data of Nt timesteps of 10 minutes, stability classes 1 to 6."""
+    rng = np.random.default_rng(seed)
+    meteo = instance_of_data_collection()
+    meteo.t = np.datetime64('2019-05-15 00:00') + np.arange(Nt)*np.timedelta64(10,'m')
+    meteo.wd = np.mod(200 + np.cumsum(rng.normal(0,10,Nt)),360)
+    meteo.U = np.clip(4 + np.cumsum(rng.normal(0,0.3,Nt)),0.3,15)
+    meteo.E = rng.integers(1,7,Nt)
+    meteo.Ta = 12 + 4*np.sin(np.arange(Nt)/144*2*np.pi) + rng.normal(0,0.2,Nt)
+    meteo.Href = 69
+    meteo.T = 10
+    return meteo
+
+def synthetic_source(Nt):
+    """BR2 stack of selenium-75.py releasing 8.3 MBq/s."""
+    source = instance_of_data_collection()
+    source.Hs = 60
+    source.Ts = 15
+    source.Vs = 150000/3600
+    source.Q = 8.3e6*np.ones(Nt)
+    return source
+
+def synthetic_nuclide_data():
+    nuclide_data = instance_of_data_collection()
+    nuclide_data.Ey = Se75_Ey
+    nuclide_data.I = Se75_I
+    return nuclide_data
+
+def write_lara_sheets(directory,n,seed=0):
+    """Writes n LARA sheets Bm-1 ... Bm-n with 20 emission lines each."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory,exist_ok=True)
+    for k in range(1,n+1):
+        lines = ['Nuclide ; Bm-%d ' % k, 'Element ; Benchmarkium', 'Z ; 99',
+                 'Daughter(s) ; (B-) ; Bm-%d ; 100' % (k+1), 'Half-life (s) ; 1.0E6 ; 0.1E6',
+                 'Emissions (20 lines) sorted by decreasing intensity', '-'*40,
+                 'Energy (keV) ; Ener. unc. (keV) ; Intensity (%) ; Int. unc. (%) ; Type ; Origin ; Lvl. start ; Lvl. end ; Possible coinc./Sum of']
+        for Ey, I, g in zip(rng.uniform(20,2000,20), np.sort(rng.uniform(0,100,20))[::-1], rng.random(20) < 0.7):
+            lines.append('%.4f ; 0.001 ; %.4f ; 0.01 ; %s ; Bm ; 1 ; 0 ;  ; ' % (Ey, I, 'g' if g else 'XKa1'))
+        lines.append('='*40)
+        with open(os.path.join(directory,'Bm-%d.lara.txt' % k),'w') as f:
+            f.write('\n'.join(lines)+'\n')
+
+def write_mast_files(directory,days,seed=0):
+    """Writes days daily mast CSV files met2019MMDD.txt with 10 minute rows."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory,exist_ok=True)
+    header = 'Date_Time;Rotors;T8;T114;Speed;Azimuth;Elevation;AzimSigma;ElevSigma;E_dT;E_AzimSig'
+    for d in range(days):
+        day = np.datetime64('2019-05-15') + np.timedelta64(d,'D')
+        t = day + np.arange(144)*np.timedelta64(10,'m')
+        rows = [header]
+        for ti in t:
+            rows.append('%s;OK;%.2f;%.2f;%.2f;%d;%.1f;%.2f;%.2f;%d;%d' % (
+                str(ti).replace('T',' ')+':00', rng.uniform(5,20), rng.uniform(5,20),
+                rng.uniform(0.5,10), rng.integers(0,360), rng.normal(0,2),
+                rng.uniform(1,20), rng.uniform(1,10), rng.integers(1,7), rng.integers(1,7)))
+        with open(os.path.join(directory,'met%s.txt' % str(day).replace('-','')),'w') as f:
+            f.write('\n'.join(rows)+'\n')
+
+@contextlib.contextmanager
+def synthetic_data(directory,sheets=50,days=1):
+    """
+    Points read_lara() and read_selenium_meteo() to synthetic LARA sheets and
+    mast files in directory, with their caches there as well.
+    """
+    saved = (nuclide_library.default_directory, nuclide_library._default_library,
+             meteo_store.default_directory, kernel_cache.default_cache_dir)
+    write_lara_sheets(os.path.join(directory,'nuclides'),sheets)
+    write_mast_files(os.path.join(directory,'meteo'),days)
+    nuclide_library.default_directory = os.path.join(directory,'nuclides')
+    nuclide_library._default_library = None
+    meteo_store.default_directory = os.path.join(directory,'meteo')
+    kernel_cache.default_cache_dir = os.path.join(directory,'cache')
+    try:
+        yield
+    finally:
+        (nuclide_library.default_directory, nuclide_library._default_library,
+         meteo_store.default_directory, kernel_cache.default_cache_dir) = saved
+
+def measure(func,repeat=3):
+    """
+    Best and median run time of func() over repeat runs [s], and the peak
+    memory allocated during one more run [bytes]. The progress output of the
+    plume functions is discarded.
+    """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for k in range(repeat):
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter()-t0)
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'time': min(times), 'time_median': float(np.median(times)),
+            'repeat': repeat, 'peak_memory': peak}
+
+def cases(sizes,lengths,max_memory=2**30):
+    """
+    Yields the name, parameters and a setup function of every case. The
+    setup function prepares the inputs (not timed) and returns the callable
+    that is measured, or None if the case is skipped.
+    """
+    for size in sizes:
+        bx, by, bz, Nx, Ny, Nz = grid_sizes[size]
+        make_grid = lambda s=grid_sizes[size]: create_square_centered_grid(*s)
+        cells = Nx*Ny*Nz
+
+        def setup_single(make_grid=make_grid):
+            grid, meteo = make_grid(), synthetic_meteo(1)
+            source = synthetic_source(1)
+            X, Y, H, U = plume_inputs(grid,meteo,source,0.5,'hx',0)
+            return lambda: single_plume(X,Y,grid.Z,U,meteo.E[0],source.Q[0],H,meteo.T,'inversion')
+        yield 'single_plume', {'grid': size}, setup_single
+
+        def setup_buildup(cells=cells):
+            mux = np.random.default_rng(0).uniform(0,20,cells)
+            return lambda: buildup_factor(Se75_Ey[0],mux,database)
+        yield 'buildup_factor', {'grid': size}, setup_buildup
+
+        def setup_gamma(make_grid=make_grid):
+            grid, nuclide_data = make_grid(), synthetic_nuclide_data()
+            return lambda: gamma_factors(grid,xq[0],yq[0],zq[0],nuclide_data,rho,database)
+        yield 'gamma_factors', {'grid': size}, setup_gamma
+
+        for length in lengths:
+            Nt = meteo_lengths[length]
+            too_large = cells*Nt*8 > max_memory
+
+            def setup_multi(make_grid=make_grid,Nt=Nt,too_large=too_large):
+                if too_large:
+                    return None
+                grid, meteo, source = make_grid(), synthetic_meteo(Nt), synthetic_source(Nt)
+                return lambda: multi_plume(grid,meteo,source,0.5,'inversion','hx')
+            yield 'multi_plume', {'grid': size, 'meteo': length}, setup_multi
+
+            def setup_H10(make_grid=make_grid,Nt=Nt,too_large=too_large):
+                if too_large:
+                    return None
+                grid, nuclide_data = make_grid(), synthetic_nuclide_data()
+                c = np.random.default_rng(0).uniform(0,1e3,grid.X.shape+(Nt,))
+                return lambda: time_resolved_H10_many(grid,xq,yq,zq,c,nuclide_data,rho,database)
+            yield 'time_resolved_H10', {'grid': size, 'meteo': length}, setup_H10
+
+    # the library is cached after the first call, see nuclide_library.py
+    def setup_lara():
+        read_lara('Bm-1')
+        return lambda: read_lara('Bm-25')
+    yield 'read_lara', {}, setup_lara
+
+    def setup_lara_parse():
+        return lambda: nuclide_library.nuclide_library(cache_dir=False)
+    yield 'parse_lara_sheets', {'sheets': 50}, setup_lara_parse
+
+    for length in lengths:
+        Nt = meteo_lengths[length]
+        def setup_meteo(Nt=Nt):
+            t0 = np.datetime64('2019-05-15 06:00')
+            t1 = t0 + (Nt-1)*np.timedelta64(10,'m')
+            read_selenium_meteo(t0,t1)
+            return lambda: read_selenium_meteo(t0,t1)
+        yield 'read_selenium_meteo', {'meteo': length}, setup_meteo
+
+def run(sizes=('small','default'),lengths=('short','long'),repeat=3,days=30,max_memory=2**30,only=None):
+    """
+
+    Description
+    -----------
+    Runs the benchmark cases on synthetic inputs.
+
+    Parameters
+    ----------
+    sizes : grid sizes, keys of grid_sizes
+    lengths : meteo lengths, keys of meteo_lengths
+    repeat : number of timed runs per case
+    days : number of days of the synthetic mast archive
+    max_memory : cases with a larger concentration array are skipped [bytes]
+    only : optional list of case names to run
+
+    Returns
+    -------
+    results : dict with the environment and, per case, its name, parameters
+    and measurements (see measure()), or skipped=True
+
+    """
+    results = {'environment': environment(), 'cases': []}
+    with tempfile.TemporaryDirectory() as directory, synthetic_data(directory,days=days):
+        for name, params, setup in cases(sizes,lengths,max_memory):
+            if only is not None and name not in only:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                func = setup()
+            result = {'name': name, 'params': params}
+            if func is None:
+                result['skipped'] = True
+            else:
+                result.update(measure(func,repeat))
+            results['cases'].append(result)
+    return results
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+def case_id(result):
+    return result['name'] + ''.join('[%s=%s]' % kv for kv in sorted(result['params'].items()))
+
+def compare(results,baseline,time_tolerance=1.5,memory_tolerance=1.2):
+    """
+    Cases of results that are slower (best time) than in baseline by more
+    than a factor time_tolerance, or use more peak memory by more than a
+    factor memory_tolerance, as a list of messages.
+    """
+    reference = {case_id(r): r for r in baseline['cases'] if not r.get('skipped')}
+    regressions = []
+    for r in results['cases']:
+        ref = reference.get(case_id(r))
+        if ref is None or r.get('skipped'):
+            continue
+        if r['time'] > time_tolerance*ref['time']:
+            regressions.append('%s: time %.4g s, baseline %.4g s' % (case_id(r), r['time'], ref['time']))
+        if r['peak_memory'] > memory_tolerance*ref['peak_memory']:
+            regressions.append('%s: peak memory %.4g MB, baseline %.4g MB' % (
+                case_id(r), r['peak_memory']/1e6, ref['peak_memory']/1e6))
+    return regressions
+
+def report(results,file=sys.stdout):
+    for r in results['cases']:
+        if r.get('skipped'):
+            print('%-50s skipped' % case_id(r), file=file)
+        else:
+            print('%-50s %10.4f s %10.1f MB' % (case_id(r), r['time'], r['peak_memory']/1e6), file=file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ADDER benchmarks on synthetic inputs')
+    parser.add_argument('--sizes', nargs='+', default=['small','default'], choices=list(grid_sizes))
+    parser.add_argument('--lengths', nargs='+', default=['short','long'], choices=list(meteo_lengths))
+    parser.add_argument('--cases', nargs='+', default=None, help='names of the cases to run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--days', type=int, default=30, help='days of the synthetic mast archive')
+    parser.add_argument('--max-memory', type=float, default=2**30, help='bytes')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='JSON file of baseline results')
+    parser.add_argument('--time-tolerance', type=float, default=1.5)
+    parser.add_argument('--memory-tolerance', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes,args.lengths,args.repeat,args.days,args.max_memory,args.cases)
+    report(results)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results,json.load(f),args.time_tolerance,args.memory_tolerance)
+        for message in regressions:
+            print('REGRESSION', message)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk store for the concentration fields of a plume simulation, so that
+simulations larger than the memory can run and results can be re-analysed
+without rerunning the plume model.
+
+A store is a directory with:
+    - c.npy : memory-mapped array of shape (Nt, Ny, Nx, Nz), i.e. one
+      contiguous chunk per timestep, written incrementally;
+    - written.npy : flags of the timesteps that have been written;
+    - TIC.npy : time-integrated concentration field, once complete;
+    - meta.json : grid axes and meteo data of the simulation.
+
+Note that the time axis comes first, unlike the 4D array of multi_plume().
+
+Typical use:
+    store = store_plume('run1', grid, meteo, source, Umin, 'inversion', 'hx')
+    ...
+    store = concentration_store.open('run1')
+    H10, D = store.dose_rates(gf_H10, gf_D)
+"""
+
+import json
+import os
+
+import numpy as np
+
+from gamma_dosimetry import dose_rate_series
+from gaussian_plume import stream_plume, tic_accumulator
+from mathematical_tools import compact_grid, grid_shape, instance_of_data_collection
+
+meteo_fields = ['t', 'wd', 'U', 'E', 'Ta', 'sig_wd', 'Href', 'T']
+
+class concentration_store(object):
+    """
+    
+    Description
+    -----------
+    Memory-mapped store of concentration fields laid out by timestep. Use
+    concentration_store.create() to make a new store and
+    concentration_store.open() to read an existing one. A store is a
+    consumer for gaussian_plume.stream_plume(): store(i, ci) writes the field
+    of timestep i.
+
+    """
+    def __init__(self,path,mode='r'):
+        self.path = path
+        with open(os.path.join(path,'meta.json')) as f:
+            self.meta = json.load(f)
+        mmap_mode = 'r' if mode == 'r' else 'r+'
+        self.c = np.load(os.path.join(path,'c.npy'),mmap_mode=mmap_mode)
+        self.written = np.load(os.path.join(path,'written.npy'),mmap_mode=mmap_mode)
+    
+    @classmethod
+    def create(cls,path,grid,Nt,meteo=None,dtype=np.float64):
+        """
+        
+        Description
+        -----------
+        Creates an empty store for Nt timesteps on grid.
+
+        Parameters
+        ----------
+        path : directory of the store, created if needed
+        grid : class of type data_collection with the numerical grid
+        Nt : number of timesteps
+        meteo : optional class of type data_collection with the meteo data,
+        of which the fields in meteo_fields are kept in the metadata
+        dtype : data type of the stored fields
+
+        Returns
+        -------
+        store : concentration_store opened for writing
+
+        """
+        os.makedirs(path,exist_ok=True)
+        meta = {
+            'version'   : 1,
+            'Nt'        : int(Nt),
+            'dtype'     : np.dtype(dtype).str,
+            'grid'      : {
+                'x'  : grid.X[0,:,0].tolist(),
+                'y'  : grid.Y[:,0,0].tolist(),
+                'z'  : grid.Z[0,0,:].tolist(),
+                'dx' : float(grid.dx),
+                'dy' : float(grid.dy),
+                'dz' : float(grid.dz)},
+            'meteo'     : _meteo_to_json(meteo)}
+        with open(os.path.join(path,'meta.json'),'w') as f:
+            json.dump(meta,f,indent=1)
+        shape = (int(Nt),)+grid_shape(grid)
+        np.lib.format.open_memmap(os.path.join(path,'c.npy'),mode='w+',dtype=dtype,shape=shape).flush()
+        np.save(os.path.join(path,'written.npy'),np.zeros(int(Nt),dtype=bool))
+        return cls(path,mode='r+')
+    
+    @classmethod
+    def open(cls,path,mode='r'):
+        """Opens an existing store, mode 'r' for reading or 'r+' to write."""
+        return cls(path,mode)
+    
+    def __len__(self):
+        return self.c.shape[0]
+    
+    def __call__(self,i,ci):
+        self.c[i] = ci
+        self.written[i] = True
+    
+    def __getitem__(self,i):
+        return self.c[i]
+    
+    @property
+    def complete(self):
+        return bool(np.all(self.written))
+    
+    def grid(self):
+        """Returns the grid of the simulation as a data_collection."""
+        g = self.meta['grid']
+        return compact_grid(g['x'],g['y'],g['z'],g['dx'],g['dy'],g['dz']).dense()
+    
+    def meteo(self):
+        """Returns the stored meteo data as a data_collection, or None."""
+        return _meteo_from_json(self.meta['meteo'])
+    
+    def iter_timesteps(self,i0=0,i1=None):
+        """Yields (i, ci) for timesteps i0 to i1-1, read lazily."""
+        for i in range(i0,len(self) if i1 is None else i1):
+            yield i, self.c[i]
+    
+    def stream(self,consumers,i0=0,i1=None):
+        """
+        Feeds the stored fields to consumers as gaussian_plume.stream_plume()
+        would, e.g. to compute TIC or dose rates for new detectors.
+        """
+        for i, ci in self.iter_timesteps(i0,i1):
+            for consumer in consumers:
+                consumer(i,ci)
+        return consumers
+    
+    def dose_rates(self,gf_H10,gf_D,block_size=16):
+        """
+        
+        Description
+        -----------
+        gamma_dosimetry.dose_rate_series() of the stored fields, reading
+        block_size timesteps at a time.
+
+        Returns
+        -------
+        H10 : Ambient dose equivalent rate, shape (n_detectors, Nt) or (Nt,)
+        [nSv/h]
+        D : Gamma dose rate to air, same shape as H10 [nGy/h]
+
+        """
+        shape = np.shape(gf_H10)[:-3]+(len(self),)
+        H10, D = np.zeros(shape), np.zeros(shape)
+        for i0 in range(0,len(self),block_size):
+            i1 = min(i0+block_size,len(self))
+            # time on the last axis, as in multi_plume()
+            cb = np.moveaxis(self.c[i0:i1],0,-1)
+            dose_rate_series(gf_H10,gf_D,cb,out=(H10[...,i0:i1],D[...,i0:i1]))
+        return H10, D
+    
+    def TIC(self):
+        """
+        Returns the time-integrated concentration field [Bq*s/m3], from
+        TIC.npy if it exists or else from the stored fields.
+        """
+        path = os.path.join(self.path,'TIC.npy')
+        if os.path.exists(path):
+            return np.load(path)
+        T = self.meta['meteo']['T'] if self.meta['meteo'] else None
+        if T is None:
+            raise ValueError("The meteo averaging time T is not in the store")
+        tic = tic_accumulator(self.c.shape[1:],T)
+        self.stream([tic])
+        return tic.TIC
+    
+    def save_TIC(self,TIC):
+        np.save(os.path.join(self.path,'TIC.npy'),TIC)
+    
+    def flush(self):
+        if isinstance(self.c,np.memmap) and self.c.mode != 'r':
+            self.c.flush()
+            self.written.flush()
+
+def store_plume(path,grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,L=1e20,dtype=np.float64,**kwargs):
+    """
+    
+    Description
+    -----------
+    Runs gaussian_plume.stream_plume() and writes every timestep to a new
+    concentration_store, together with the TIC field. Only one timestep (or
+    block, see multi_plume()) is kept in memory.
+
+    Parameters
+    ----------
+    path : directory of the store
+    dtype : data type in which the fields are computed and stored
+    see multi_plume() for the other parameters, which are passed on to
+    stream_plume()
+
+    Returns
+    -------
+    store : the concentration_store, opened for reading
+
+    """
+    store = concentration_store.create(path,grid,len(meteo.wd),meteo,dtype)
+    tic = tic_accumulator(grid_shape(grid),meteo.T)
+    stream_plume(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,[store,tic],L,dtype=dtype,**kwargs)
+    store.flush()
+    store.save_TIC(tic.TIC)
+    return concentration_store.open(path)
+
+def _meteo_to_json(meteo):
+    if meteo is None:
+        return None
+    d = {}
+    for name in meteo_fields:
+        if hasattr(meteo,name):
+            v = getattr(meteo,name)
+            if name == 't':
+                d[name] = [str(ti) for ti in np.asarray(v)]
+            else:
+                d[name] = np.asarray(v).tolist()
+    return d
+
+def _meteo_from_json(d):
+    if d is None:
+        return None
+    meteo = instance_of_data_collection()
+    for name, v in d.items():
+        if name == 't':
+            setattr(meteo,name,np.array(v,dtype='datetime64[ns]'))
+        elif isinstance(v,list):
+            setattr(meteo,name,np.array(v))
+        else:
+            setattr(meteo,name,v)
+    return meteo
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Ground-level dose rate maps: H*(10) and air kerma rates at every (x, y) cell
+of the grid, at a receptor height zq, for every timestep.
+
+Evaluating gamma_factors() for each of the Nx*Ny receptors would cost
+O((Nx*Ny)**2*Nz). On the uniform grid of create_square_centered_grid(), the
+gamma factor of a cell only depends on its displacement from the receptor
+(and on its height, through the ground halving), so the map is a sum over
+the z layers of 2D convolutions of the concentration layers with kernel
+layers. The kernel is computed once with gamma_factors_many() for a receptor
+at the origin of a grid of displacements, and the convolutions are evaluated
+with zero-padded FFTs, which makes them exact up to round-off (about 1e-13
+of the peak dose rate).
+"""
+
+import numpy as np
+
+from gamma_dosimetry import gamma_factors_many
+from mathematical_tools import compact_grid
+
+def _fast_length(n):
+    """Smallest 2**a*3**b*5**c >= n, an efficient FFT length."""
+    m = n
+    while True:
+        k = m
+        for p in (2, 3, 5):
+            while k % p == 0:
+                k //= p
+        if k == 1:
+            return m
+        m += 1
+
+def grid_axes(grid):
+    """
+    1D axes x, y, z of a grid, checked to be uniform with the spacings
+    grid.dx, grid.dy and grid.dz.
+    """
+    axes = (np.ravel(grid.X[0,:,0]), np.ravel(grid.Y[:,0,0]), np.ravel(grid.Z[0,0,:]))
+    for a, d in zip(axes, (grid.dx, grid.dy, grid.dz)):
+        if len(a) > 1 and not np.allclose(np.diff(a), d, rtol=1e-9, atol=0):
+            raise ValueError('dose maps need a uniform grid')
+    return axes
+
+class dose_map(object):
+    """
+
+    Description
+    -----------
+    FFT convolution engine for ground-level dose rate maps. The kernel is
+    computed and transformed once; every concentration field then costs Nz
+    forward and two inverse 2D FFTs of about (3*Ny)x(3*Nx) points. The object
+    is a consumer for gaussian_plume.stream_plume(): with Nt given, dose(i,
+    ci) stores the maps of timestep i in H10[i] and D[i].
+
+    Parameters
+    ----------
+    grid : uniform grid, see create_square_centered_grid()
+    nuclide_data : collection of gamma energies and intensities, see read_lara()
+    rho : Density of air [g/cm3]
+    database : build-up factor table, see buildup_factor()
+    zq : height of the receptors above the ground [m]
+    Nt : optional number of timesteps to store
+
+    """
+    def __init__(self,grid,nuclide_data,rho,database,zq=1.,Nt=None):
+        x, y, z = grid_axes(grid)
+        self.Nx, self.Ny, self.Nz = len(x), len(y), len(z)
+        self.x, self.y, self.zq = x, y, zq
+
+        # gamma factors of a receptor at the origin, for cells at all
+        # displacements (2*Ny-1)x(2*Nx-1) and at the heights of the grid
+        xk = grid.dx*np.arange(-(self.Nx-1), self.Nx)
+        yk = grid.dy*np.arange(-(self.Ny-1), self.Ny)
+        kgrid = compact_grid(xk,yk,z,grid.dx,grid.dy,grid.dz)
+        gf_H10, gf_D = gamma_factors_many(kgrid,[0.],[0.],[zq],nuclide_data,rho,database)
+
+        # the map is a correlation with the kernel, i.e. a convolution with
+        # the kernel flipped in x and y
+        K = np.stack([gf_H10[0], gf_D[0]])[:,::-1,::-1,:]
+        self.shape = (_fast_length(3*self.Ny-2), _fast_length(3*self.Nx-2))
+        self.K = np.fft.rfft2(np.moveaxis(K,-1,1), s=self.shape)
+
+        if Nt is not None:
+            self.H10 = np.zeros((Nt,self.Ny,self.Nx))
+            self.D = np.zeros((Nt,self.Ny,self.Nx))
+
+    def evaluate(self,ci):
+        """
+
+        Description
+        -----------
+        Dose rate maps of a concentration field.
+
+        Parameters
+        ----------
+        ci : 3D concentration field [Bq/m3]
+
+        Returns
+        -------
+        H10 : Ambient dose equivalent rate at every ground cell, shape
+        (Ny, Nx) [nSv/h]
+        D : Gamma dose rate to air at every ground cell [nGy/h]
+
+        """
+        C = np.fft.rfft2(np.moveaxis(np.asarray(ci,dtype=np.float64),-1,0), s=self.shape)
+        HD = np.fft.irfft2(np.einsum('kyx,nkyx->nyx',C,self.K), s=self.shape)
+        HD = HD[:,self.Ny-1:2*self.Ny-1,self.Nx-1:2*self.Nx-1]
+        return HD[0], HD[1]
+
+    def __call__(self,i,ci):
+        self.H10[i], self.D[i] = self.evaluate(ci)
+
+def dose_maps(grid,c,nuclide_data,rho,database,zq=1.):
+    """
+
+    Description
+    -----------
+    Ground-level dose rate maps for all timesteps of c, see dose_map.
+
+    Parameters
+    ----------
+    see dose_map
+    c : 4D array of concentrations with time on the last axis [Bq/m3]
+
+    Returns
+    -------
+    H10 : Ambient dose equivalent rate maps, shape (Nt, Ny, Nx) [nSv/h]
+    D : Gamma dose rate to air maps, shape (Nt, Ny, Nx) [nGy/h]
+
+    """
+    engine = dose_map(grid,nuclide_data,rho,database,zq,Nt=c.shape[-1])
+    for i in range(c.shape[-1]):
+        engine(i,c[...,i])
+    return engine.H10, engine.D
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo ensembles of the Gaussian plume model, the counterpart of the
+Julia src/montecarlo.jl for multi_plume(). Members are obtained by perturbing
+the meteo data and the source term, and only the dose rate series at the
+detectors are kept, never the concentration fields of the members.
+
+A perturbation is a callable f(rng, x, meteo) that returns a perturbed copy
+of the field x, where meteo holds the (already perturbed) meteo data of the
+member. The fields are perturbed in the order of perturbed_fields, so that
+e.g. the wind direction can use a perturbed sig_wd.
+"""
+
+import copy
+
+import numpy as np
+
+from gamma_dosimetry import dose_rate_accumulator
+from gaussian_plume import inversion_heights, stream_plume, tic_accumulator
+from mathematical_tools import grid_shape, instance_of_data_collection
+
+perturbed_fields = ['sig_wd', 'wd', 'U', 'E', 'Ta', 'Q']
+
+def additive_normal(std):
+    """Adds normally distributed noise with standard deviation std."""
+    def perturb(rng,x,meteo):
+        return x + rng.normal(0,std,np.shape(x))
+    return perturb
+
+def multiplicative_lognormal(sigma):
+    """Multiplies by a log-normal factor with median 1 and log-std sigma."""
+    def perturb(rng,x,meteo):
+        return x*np.exp(rng.normal(0,sigma,np.shape(x)))
+    return perturb
+
+def wind_direction_from_sigma(scale=1):
+    """
+    Adds normally distributed noise to the wind direction with, for every
+    timestep, a standard deviation of scale*meteo.sig_wd [deg].
+    """
+    def perturb(rng,x,meteo):
+        return np.mod(x + scale*meteo.sig_wd*rng.normal(0,1,np.shape(x)),360)
+    return perturb
+
+def stability_shift(p_down=0.25,p_up=0.25):
+    """
+    Shifts the Bultynck-Malet stability class one class down or up with
+    probabilities p_down and p_up, within classes 1 to 6. Class 7 follows
+    from the wind speed (see stability_class()) and is left as is.
+    """
+    def perturb(rng,x,meteo):
+        shift = rng.choice([-1,0,1],size=np.shape(x),p=[p_down,1-p_down-p_up,p_up])
+        return np.where(x == 7, x, np.clip(x + shift,1,6)).astype(np.asarray(x).dtype)
+    return perturb
+
+def perturb_member(meteo,source,perturbations,rng):
+    """
+    
+    Description
+    -----------
+    Returns perturbed copies of meteo and source for one ensemble member.
+
+    Parameters
+    ----------
+    meteo : class of type data_collection with the meteo data
+    source : class of type data_collection with the source data
+    perturbations : dict from field names (see perturbed_fields, 'Q' is a
+    field of source) to perturbations
+    rng : np.random.Generator
+
+    Returns
+    -------
+    meteo_m, source_m : perturbed copies
+
+    """
+    meteo_m = copy.copy(meteo)
+    source_m = copy.copy(source)
+    for name in perturbations:
+        if name not in perturbed_fields:
+            raise ValueError("Cannot perturb '%s', only %s" % (name,perturbed_fields))
+    for name in perturbed_fields:
+        if name in perturbations:
+            target = source_m if name == 'Q' else meteo_m
+            x = np.asarray(getattr(target,name))
+            setattr(target,name,perturbations[name](rng,x,meteo_m))
+    return meteo_m, source_m
+
+def run_ensemble(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,N,perturbations,L=1e20,seed=None,members_per_batch=1,percentiles=(5,50,95),keep_members=True,TIC=False,**kwargs):
+    """
+    
+    Description
+    -----------
+    Runs an ensemble of N perturbed members of multi_plume() and returns the
+    dose rates at the detectors of gf_H10 and gf_D (see
+    gamma_dosimetry.gamma_factors_many()) for every member, with summary
+    statistics. The fields are streamed (see stream_plume()), so that no
+    member's 4D concentration array is ever built.
+
+    members_per_batch members are concatenated along the time axis and
+    evaluated together, which combined with block_size (see multi_plume())
+    evaluates timesteps of several members in one vectorized block. The
+    workers and executor arguments spread these blocks over a pool.
+
+    Parameters
+    ----------
+    see multi_plume() for grid, meteo, source, Umin, switch_plume_type,
+    switch_plume_rise and L
+    gf_H10 : H*(10) gamma factors, shape (n_detectors, Ny, Nx, Nz)
+    gf_D : Air kerma gamma factors, same shape as gf_H10
+    N : number of members
+    perturbations : dict from field names to perturbations, see
+    perturb_member()
+    seed : seed of the random number generator
+    members_per_batch : number of members evaluated together
+    percentiles : percentiles of the dose rates over the members [%]
+    keep_members : whether to return the dose rates of all members
+    TIC : whether to return the ensemble mean TIC field
+    kwargs : block_size, workers, executor, passed to stream_plume()
+
+    Returns
+    -------
+    ens : data_collection with
+        H10_mean, H10_std, D_mean, D_std : mean and standard deviation over
+        the members, shape (n_detectors, Nt)
+        H10_percentiles, D_percentiles : shape (len(percentiles),
+        n_detectors, Nt)
+        H10, D : dose rates of all members, shape (N, n_detectors, Nt), if
+        keep_members (percentiles need them during the run in any case)
+        samples : dict with the perturbed fields of all members, shape (N, Nt)
+        TIC : ensemble mean TIC field, if TIC
+
+    """
+    rng = np.random.default_rng(seed)
+    Nt = len(meteo.wd)
+    L = inversion_heights(L,Nt)
+    gf_H10 = np.reshape(gf_H10,(-1,)+np.shape(gf_H10)[-3:])
+    gf_D = np.reshape(gf_D,(-1,)+np.shape(gf_D)[-3:])
+    n_det = gf_H10.shape[0]
+    
+    H10 = np.zeros((N,n_det,Nt))
+    D = np.zeros((N,n_det,Nt))
+    samples = {name: np.zeros((N,Nt)) for name in perturbations}
+    tic = tic_accumulator(grid_shape(grid),meteo.T) if TIC else None
+    
+    for m0 in range(0,N,members_per_batch):
+        m1 = min(m0+members_per_batch,N)
+        members = [perturb_member(meteo,source,perturbations,rng) for m in range(m0,m1)]
+        for m, (meteo_m, source_m) in enumerate(members):
+            for name in perturbations:
+                target = source_m if name == 'Q' else meteo_m
+                samples[name][m0+m] = getattr(target,name)
+        meteo_b, source_b = _concatenate(members)
+        acc = dose_rate_accumulator(gf_H10,gf_D,(m1-m0)*Nt)
+        consumers = [acc] if tic is None else [acc,tic]
+        stream_plume(grid,meteo_b,source_b,Umin,switch_plume_type,switch_plume_rise,consumers,np.tile(L,m1-m0),**kwargs)
+        H10[m0:m1] = np.moveaxis(acc.H10.reshape(n_det,m1-m0,Nt),1,0)
+        D[m0:m1] = np.moveaxis(acc.D.reshape(n_det,m1-m0,Nt),1,0)
+    
+    ens = instance_of_data_collection()
+    ddof = 1 if N > 1 else 0
+    ens.H10_mean, ens.H10_std = H10.mean(0), H10.std(0,ddof=ddof)
+    ens.D_mean, ens.D_std = D.mean(0), D.std(0,ddof=ddof)
+    ens.percentiles = np.asarray(percentiles)
+    ens.H10_percentiles = np.percentile(H10,percentiles,axis=0)
+    ens.D_percentiles = np.percentile(D,percentiles,axis=0)
+    ens.samples = samples
+    if keep_members:
+        ens.H10, ens.D = H10, D
+    if TIC:
+        ens.TIC = tic.TIC/N
+    return ens
+
+def _concatenate(members):
+    # members concatenated along the time axis, as a single longer run
+    meteo_b = copy.copy(members[0][0])
+    source_b = copy.copy(members[0][1])
+    for name in ['wd','U','E','Ta']:
+        setattr(meteo_b,name,np.concatenate([np.atleast_1d(getattr(m[0],name)) for m in members]))
+    source_b.Q = np.concatenate([np.atleast_1d(m[1].Q) for m in members])
+    return meteo_b, source_b
@@ -7,36 +7,26 @@
 import numpy as np
 import pandas as pd
 import os
-from scipy.interpolate import interp1d
 
-from mathematical_tools import find_nearest
+import kernel_cache
+from shared_buffers import as_array
+from mathematical_tools import find_nearest_many, grid_shape
 
+"""
+Tables
+------
+The literal tables below are only built once per process: lookup_table()
+builds them on first use and keeps them in _table_registry, where they are
+shared by all later calls. Build-up tables can be added by the user with
+register_buildup_table().
+"""
 
-def attenuation(Ey,rho):
-    """
-    
-    Description
-    -----------
-    Yields attenuation coefficients of air as described in Martin (2013).
-    mu is given in 1/cm while mu/rho and mu_en/rho are given in in cm2/g. We
-    thus first multiply by rho to obtain mu(rho) and mu_en(rho), and we also
-    multiply by a factor 100 to convert from 1/cm to 1/m.
-
-    Parameters
-    ----------
-    Ey : Energy of gamma ray [keV]
-    rho : Density of air [g/cm3]
-
-    Returns
-    -------
-    mu : Mass attennuation [1/m]
-    mu_en : Mass energy absorption [1/m]
-    
-    References
-    ----------
-    Martin, J.E. (2013) Physics for Radiation Protection, Weinheim: Wiley. DOI:
-        https://doi.org/10.1002/9783527667062
+_table_registry = {}
 
+def attenuation_table():
+    """
+    Returns the attenuation coefficients of air (Martin, 2013) with columns
+    energy [keV], mu [1/cm], mu/rho [cm2/g] and mu_en/rho [cm2/g].
     """
     data = np.array([
     #keV    mu          mu/rho      mu_en/rho
@@ -71,32 +61,177 @@ def attenuation(Ey,rho):
    [6129,   3.01E-5,    0.0250,     0.0164,],
    [7000,   2.83e-5,    0.0235,     0.0159,],
    [7115,   2.82E-5,    0.0234,     0.0158,],
-   [10000,  2.46E-5,    0.0205,     0.0145]]);
+   [10000,  2.46E-5,    0.0205,     0.0145]])
+    return data
 
-    mu_itp = interp1d(data[:,0], data[:,2])
-    mu_en_itp = interp1d(data[:,0], data[:,3])
-    mu = mu_itp(Ey)*rho*100
-    mu_en = mu_en_itp(Ey)*rho*100
+def H10_table():
+    """
+    Returns the conversion coefficients from air kerma to ambient dose
+    equivalent (ICRP, 1996) with columns energy [MeV] and H*(10)/Ka [Sv/Gy].
+    """
+    data = np.array([
+    [0.010,  0.008],
+    [0.015,  0.26],
+    [0.020,  0.61],
+    [0.030,  1.10],
+    [0.040,  1.47],
+    [0.050,  1.67],
+    [0.060,  1.74],
+    [0.080,  1.72],
+    [0.100,  1.65],
+    [0.150,  1.49],
+    [0.200,  1.40],
+    [0.300,  1.31],
+    [0.400,  1.26],
+    [0.500,  1.23],
+    [0.600,  1.21],
+    [0.800,  1.19],
+    [1,      1.17],
+    [1.5,    1.15],
+    [2,      1.14],
+    [3,      1.13],
+    [4,      1.12],
+    [5,      1.11],
+    [6,      1.11],
+    [8,      1.11],
+    [10,     1.10]])
+    return data
+
+def lookup_table(name):
+    """
     
-    return mu, mu_en
+    Description
+    -----------
+    Returns a table from the registry, building it on first use. The arrays
+    are read-only since they are shared by all callers.
+
+    Parameters
+    ----------
+    name : 'attenuation', 'H10', or the name of a build-up factor database.
+    Following buildup_factor(), names containing "martin" or "nucl" refer to
+    the built-in databases unless a table of that exact name was registered.
+
+    Returns
+    -------
+    table : array for 'attenuation' and 'H10', tuple (Ba, Eya, muxa) for
+    build-up factor databases (see buildup_tables())
 
-def buildup_factor(Ey,mux,database):
+    """
+    if name in _table_registry:
+        return _table_registry[name]
     
+    if name == 'attenuation':
+        key, build = name, attenuation_table
+    elif name == 'H10':
+        key, build = name, H10_table
+    elif "martin" in name:
+        key, build = 'martin', lambda: buildup_tables('martin')
+    elif "nucl" in name:
+        key, build = 'nucl', lambda: buildup_tables('nucl')
+    else:
+        raise ValueError("Unknown table '%s'" % name)
+    
+    if key not in _table_registry:
+        _table_registry[key] = _freeze(build())
+    return _table_registry[key]
+
+def register_buildup_table(name,Ba,Eya,muxa):
     """
     
     Description
     -----------
+    Adds a user-supplied table of build-up factors to the registry, after
+    which name can be passed as database to buildup_factor(), gamma_factors(),
+    etc.
+
+    Parameters
+    ----------
+    name : Name of the database [-]
+    Ba : Table of build-up factors, rows for muxa and columns for Eya [-]
+    Eya : Increasing tabulated gamma energies [keV]
+    muxa : Increasing tabulated numbers of mean free paths [-]
+
+    """
+    Ba = np.array(Ba, dtype=np.float64)
+    Eya = np.array(Eya, dtype=np.float64)
+    muxa = np.array(muxa, dtype=np.float64)
+    if Ba.shape != (len(muxa),len(Eya)):
+        raise ValueError("Ba should have shape (len(muxa), len(Eya))")
+    if len(Eya) < 2 or len(muxa) < 2:
+        raise ValueError("Eya and muxa need at least two values")
+    if np.any(np.diff(Eya) <= 0) or np.any(np.diff(muxa) <= 0):
+        raise ValueError("Eya and muxa should be strictly increasing")
+    _table_registry[name] = _freeze((Ba, Eya, muxa))
+
+def interp_table(x,xp,fp):
+    """
+    Linear interpolation in a table for scalar or array x. Like the interp1d
+    objects that were used before, values outside of xp raise a ValueError.
+    """
+    if np.any(np.asarray(x) < xp[0]) or np.any(np.asarray(x) > xp[-1]):
+        raise ValueError("A value is outside of the interpolation range "
+                         "[%g, %g]." % (xp[0],xp[-1]))
+    return np.interp(x,xp,fp)
+
+def _freeze(table):
+    arrays = table if isinstance(table, tuple) else (table,)
+    for a in arrays:
+        a.setflags(write=False)
+    return table
+
+
+
+def attenuation(Ey,rho):
+    """
     
+    Description
+    -----------
+    Yields attenuation coefficients of air as described in Martin (2013).
+    mu is given in 1/cm while mu/rho and mu_en/rho are given in in cm2/g. We
+    thus first multiply by rho to obtain mu(rho) and mu_en(rho), and we also
+    multiply by a factor 100 to convert from 1/cm to 1/m.
+
     Parameters
     ----------
     Ey : Energy of gamma ray [keV]
-    mux : No. of mean free paths (mass attenuation * distance) [-]
+    rho : Density of air [g/cm3]
+
+    Returns
+    -------
+    mu : Mass attennuation [1/m]
+    mu_en : Mass energy absorption [1/m]
+    
+    References
+    ----------
+    Martin, J.E. (2013) Physics for Radiation Protection, Weinheim: Wiley. DOI:
+        https://doi.org/10.1002/9783527667062
+
+    """
+    data = lookup_table('attenuation')
+    mu = interp_table(Ey,data[:,0],data[:,2])*rho*100
+    mu_en = interp_table(Ey,data[:,0],data[:,3])*rho*100
+    
+    return mu, mu_en
+
+def buildup_tables(database):
+    
+    """
+    
+    Description
+    -----------
+    Returns the tabulated build-up factors of air as a function of the number
+    of mean free paths and of the gamma energy.
+    
+    Parameters
+    ----------
     database: "martin" for build-up factors from Martin (2013) or "nucl" for
     data from Trubey et al (1991). [-]
     
     Returns
     -------
-    B : Array of build-up factors (for each mux) [-]
+    Ba : Table of build-up factors, rows for muxa and columns for Eya [-]
+    Eya : Tabulated gamma energies [keV]
+    muxa : Tabulated numbers of mean free paths [-]
     
     References
     ----------
@@ -153,16 +288,80 @@ def buildup_factor(Ey,mux,database):
         [1.85,  3.88,   29.7,   195,    1070,   3480,   11100,  15700,  17000,  10500,  4010,   1870,   1050,   665,    345,    212,    100,    63.2,   36.7,   26.3,   21,     16.9,   14.1,   11.6,   8.31]]) # mux=40
         Eya = np.array([0.015,0.02,0.03,0.04,0.05,0.06,0.08,0.1,0.15,0.2,0.3,0.4,0.5,0.6,0.8,1,1.5,2,3,4,5,6,8,10,15])*1000
         muxa = np.array([0,0.5,1,2,3,4,5,6,7,8,10,15,20,25,30,35,40])
-   
-    iEy = find_nearest(Eya,Ey)
-    B = 0*mux
-    for i in range(mux.shape[0]):
-        for j in range(mux.shape[1]):
-            for k in range(mux.shape[2]):
-                imux= find_nearest(muxa, mux[i,j,k])
-                B0 = Ba[imux[0],iEy[0]] + (Ba[imux[0],iEy[1]]-Ba[imux[0],iEy[0]]) / (Eya[iEy[1]]-Eya[iEy[0]]) * (Ey-Eya[iEy[0]])
-                B1 = Ba[imux[1],iEy[0]] + (Ba[imux[1],iEy[1]]-Ba[imux[1],iEy[0]]) / (Eya[iEy[1]]-Eya[iEy[0]]) * (Ey-Eya[iEy[0]])
-                B[i,j,k]  = B0+(B1-B0)/(muxa[imux[1]]-muxa[imux[0]])*(mux[i,j,k]-muxa[imux[0]])
+    else:
+        raise ValueError("database should be 'martin' or 'nucl'")
+    
+    return Ba, Eya, muxa
+
+def buildup_factor(Ey,mux,database,chunk_size=2**18):
+    
+    """
+    
+    Description
+    -----------
+    Interpolates the build-up factors of buildup_tables() for a gamma energy
+    and an array of numbers of mean free paths. See interpolate_buildup().
+    
+    Parameters
+    ----------
+    Ey : Energy of gamma ray [keV]
+    mux : No. of mean free paths (mass attenuation * distance) [-]
+    database: "martin" for build-up factors from Martin (2013) or "nucl" for
+    data from Trubey et al (1991). [-]
+    chunk_size : Number of elements of mux processed at once [-]
+    
+    Returns
+    -------
+    B : Array of build-up factors (for each mux) [-]
+    
+    """
+    
+    Ba, Eya, muxa = lookup_table(database)
+    B = interpolate_buildup(Ey,mux,Ba,Eya,muxa,chunk_size)
+    
+    return B
+
+def interpolate_buildup(Ey,mux,Ba,Eya,muxa,chunk_size=2**18):
+    """
+    
+    Description
+    -----------
+    Batched bilinear interpolation in a table of build-up factors. For every
+    element of mux, the two nearest tabulated energies and numbers of mean free
+    paths are used (see find_nearest()), so that values beyond the last row of
+    the table are linearly extrapolated. mux is processed in chunks of
+    chunk_size elements to bound the size of the temporary arrays.
+
+    Parameters
+    ----------
+    Ey : Energy of gamma ray [keV]
+    mux : Array of no. of mean free paths (mass attenuation * distance) [-]
+    Ba : Table of build-up factors, rows for muxa and columns for Eya [-]
+    Eya : Tabulated gamma energies [keV]
+    muxa : Tabulated numbers of mean free paths [-]
+    chunk_size : Number of elements of mux processed at once [-]
+
+    Returns
+    -------
+    B : Array of build-up factors with the shape of mux, in float32 if mux
+    is float32 [-]
+
+    """
+    iEy = find_nearest_many(Eya,Ey)
+    BE  = Ba[:,iEy[0]] + (Ba[:,iEy[1]]-Ba[:,iEy[0]]) / (Eya[iEy[1]]-Eya[iEy[0]]) * (Ey-Eya[iEy[0]])
+    
+    mux = np.asarray(mux)
+    if mux.dtype == np.float32:
+        BE, muxa = BE.astype(np.float32), np.asarray(muxa,np.float32)
+    B = np.empty(mux.shape, dtype=np.result_type(mux, BE))
+    mux_flat = mux.reshape(-1)
+    B_flat = B.reshape(-1)
+    for i0 in range(0, mux_flat.size, chunk_size):
+        muxi = mux_flat[i0:i0+chunk_size]
+        il, iu = find_nearest_many(muxa, muxi)
+        B0 = BE[il]
+        B1 = BE[iu]
+        B_flat[i0:i0+chunk_size] = B0+(B1-B0)/(muxa[iu]-muxa[il])*(muxi-muxa[il])
     
     return B
 
@@ -192,38 +391,32 @@ def Gy_to_H10(Ka,Ey):
         (Accessed: 2 February 958 2022)
 
     """
-    data = np.array([
-    [0.010,  0.008],
-    [0.015,  0.26],
-    [0.020,  0.61],
-    [0.030,  1.10],
-    [0.040,  1.47],
-    [0.050,  1.67],
-    [0.060,  1.74],
-    [0.080,  1.72],
-    [0.100,  1.65],
-    [0.150,  1.49],
-    [0.200,  1.40],
-    [0.300,  1.31],
-    [0.400,  1.26],
-    [0.500,  1.23],
-    [0.600,  1.21],
-    [0.800,  1.19],
-    [1,      1.17],
-    [1.5,    1.15],
-    [2,      1.14],
-    [3,      1.13],
-    [4,      1.12],
-    [5,      1.11],
-    [6,      1.11],
-    [8,      1.11],
-    [10,     1.10]])
-
-    itp = interp1d(data[:,0],data[:,1])
-    H10 = Ka*itp(Ey/1e3)
+    H10 = Ka*H10_coefficient(Ey)
     
     return H10
 
+def H10_coefficient(Ey):
+    """
+    
+    Description
+    -----------
+    Conversion coefficient from air kerma to ambient dose equivalent (ICRP,
+    1996), see Gy_to_H10(). Accepts scalars as well as arrays of energies.
+
+    Parameters
+    ----------
+    Ey : Energy of gamma ray [keV]
+
+    Returns
+    -------
+    h : Conversion coefficient [Sv/Gy]
+
+    """
+    data = lookup_table('H10')
+    h = interp_table(Ey/1e3,data[:,0],data[:,1])
+    
+    return h
+
 def gamma_dose_rate(grid,xq,yq,zq,c,nuclide_data,rho,database):
     """
     
@@ -268,7 +461,7 @@ def gamma_dose_rate(grid,xq,yq,zq,c,nuclide_data,rho,database):
         B = buildup_factor(nuclide_data.Ey[i],mux,database)
         mux[mux==0] = np.inf
         Dr= prefac*q*B*np.exp(-mux)/(mux/mu)**2*1e9*3600 #nGy/h
-        Dr[grid.Z==0] = Dr[grid.Z==0]/2
+        Dr = np.where(grid.Z==0, Dr/2, Dr)
         Di = nuclide_data.I[i]*np.sum(Dr)
         D = D + Di
         H10 = H10 + Gy_to_H10(Di,nuclide_data.Ey[i])
@@ -314,28 +507,481 @@ def gamma_factors(grid,xq,yq,zq,nuclide_data,rho,database):
         Information Center/U.S. Department of Energy, pp.301.
     
     """
-    gf_D = np.zeros(grid.X.shape)
-    gf_H10 = np.zeros(grid.X.shape)
-    c = np.zeros(grid.X.shape) + 1
-    for i in range(nuclide_data.Ey.shape[0]):
-        mu, mu_en = attenuation(nuclide_data.Ey[i],rho)
-        prefac = 1/100*0.0364*(1293/(rho*1e6))*mu_en*nuclide_data.Ey[i]*1e-3
-        q = c*grid.dx*grid.dy*grid.dz/3.7e10
-        mux = mu*np.sqrt((grid.X-xq)**2+(grid.Y-yq)**2+(grid.Z-zq)**2)
-        B = buildup_factor(nuclide_data.Ey[i],mux,database)
-        mux[mux==0] = np.inf
-        Dr= prefac*q*B*np.exp(-mux)/(mux/mu)**2*1e9*3600 #nGy/h
-        Dr[grid.Z==0] = Dr[grid.Z==0]/2
-        Di = nuclide_data.I[i]*Dr
-        gf_D = gf_D + Di
-        gf_H10 = gf_H10 + Gy_to_H10(Di,nuclide_data.Ey[i])
+    gf_H10, gf_D = gamma_factors_many(grid,[xq],[yq],[zq],nuclide_data,rho,database)
+    return gf_H10[0], gf_D[0]
+
+def gamma_factors_many(grid,xq,yq,zq,nuclide_data,rho,database,max_memory=2**28,out=None,dtype=np.float64):
+    """
+    
+    Description
+    -----------
+    Same as gamma_factors(), but for several detectors at once. Everything
+    that does not depend on the detector position (attenuation coefficients,
+    prefactors, H*(10) conversion coefficients, ground-level cells) is only
+    computed once, and the distances are computed once per detector for all
+    gamma lines. Detectors are processed in chunks such that the temporary
+    arrays take about max_memory bytes.
+
+    Parameters
+    ----------
+    grid : class of type data_collection [1] which contains
+    all information about the numerical grid
+    xq : x coordinates of the detectors (relative to stack) [m]
+    yq : y coordinates of the detectors (relative to stack) [m]
+    zq : z coordinates of the detectors (relative to stack) [m]
+    nuclide_data : collection of gamma energies and intensities, see read_lara()
+    rho : Density of air [g/cm3]
+    database : "martin" for build-up factors from Martin (2013) or "nucl" for
+    data from Trubey et al (1991). [-]
+    max_memory : Approximate size of the temporary arrays [bytes]
+    out : optional tuple of output arrays (gf_H10, gf_D), e.g. slices of
+    np.memmap or shared_buffers.shared_buffer arrays filled by several
+    processes. They are overwritten.
+    dtype : precision of the kernel evaluation and of the factors, e.g.
+    np.float32 for screening runs (see precision.py)
+
+    Returns
+    -------
+    gf_H10 : Ambient dose equivalent rate contributions of all grid cells for a
+    unit release, stacked along a first detector axis [(nSv/h)/(Bq/m3)]
+    gf_D : Gamma dose rate to air contributions of all grid cells for a
+    unit release, stacked along a first detector axis [(nGy/h)/(Bq/m3)]
+
+    """
+    xq = np.atleast_1d(np.asarray(xq,dtype=np.float64))
+    yq = np.atleast_1d(np.asarray(yq,dtype=np.float64))
+    zq = np.atleast_1d(np.asarray(zq,dtype=np.float64))
+    Ey = np.atleast_1d(nuclide_data.Ey)
+    I = np.atleast_1d(nuclide_data.I)
+    
+    # detector-independent quantities
+    mu, mu_en = attenuation(Ey,rho)
+    prefac = 1/100*0.0364*(1293/(rho*1e6))*mu_en*Ey*1e-3
+    q = grid.dx*grid.dy*grid.dz/3.7e10
+    h = H10_coefficient(Ey)
+    mu, prefac, h, I = [np.asarray(v,dtype) for v in (mu,prefac,h,I)]
+    shape = grid_shape(grid)
+    ground = np.broadcast_to(grid.Z==0,shape)
+    
+    if out is None:
+        gf_D = np.zeros((len(xq),)+shape,dtype=dtype)
+        gf_H10 = np.zeros((len(xq),)+shape,dtype=dtype)
+    else:
+        gf_H10, gf_D = as_array(out[0]), as_array(out[1])
+        gf_H10[...] = 0
+        gf_D[...] = 0
+    
+    # about 6 grid-sized temporaries per detector in a chunk
+    chunk = max(1, int(max_memory//(6*np.dtype(dtype).itemsize*np.prod(shape))))
+    for j0 in range(0, len(xq), chunk):
+        j1 = min(j0+chunk, len(xq))
+        xj = xq[j0:j1,None,None,None]
+        yj = yq[j0:j1,None,None,None]
+        zj = zq[j0:j1,None,None,None]
+        r = np.sqrt((grid.X-xj)**2+(grid.Y-yj)**2+(grid.Z-zj)**2).astype(dtype,copy=False)
+        for i in range(len(Ey)):
+            mux = mu[i]*r
+            B = buildup_factor(Ey[i],mux,database)
+            mux[mux==0] = np.inf
+            Dr= prefac[i]*q*B*np.exp(-mux)/(mux/mu[i])**2*1e9*3600 #nGy/h
+            Dr[:,ground] = Dr[:,ground]/2
+            Di = I[i]*Dr
+            gf_D[j0:j1] += Di
+            gf_H10[j0:j1] += Di*h[i]
     return gf_H10, gf_D
 
-def time_resolved_H10(grid,xq,yq,zq,c,nuclide_data,rho,database):
-    gf_H10,gf_D = gamma_factors(grid, xq, yq, zq, nuclide_data, rho, database)
-    N = c.shape[3]
-    H10, D = np.zeros(N), np.zeros(N)
-    for i in range(N):
-        H10[i]=np.sum(c[:,:,:,i]*gf_H10)
-        D[i]=np.sum(c[:,:,:,i]*gf_D)
+class radial_kernel(object):
+    """
+    
+    Description
+    -----------
+    Lookup table of the point kernel of a set of gamma lines as a function of
+    the distance r between a cell and a detector. The kernel of gamma_factors()
+    is q*f(r)/r**2, where q is the cell volume factor of the grid and
+    
+        f(r) = sum_i I_i*prefac_i*B_i(mu_i*r)*exp(-mu_i*r)*1e9*3600
+    
+    is smooth between the points where buildup_factor() switches between
+    pairs of tabulated numbers of mean free paths (where it jumps, see
+    find_nearest()). f (for D and H*(10)) is tabulated on a distance axis
+    that is uniform apart from nodes on both sides of those points, and
+    interpolated linearly. The uniform spacing is refined until the
+    interpolation error at the midpoints of the table, relative to the exact
+    f there, is at most tol. The table does not depend on the grid or the
+    detectors.
+
+    Parameters
+    ----------
+    nuclide_data : collection of gamma energies and intensities, see read_lara()
+    rho : Density of air [g/cm3]
+    database : build-up factor table, see buildup_factor()
+    r_max : largest distance of the table [m]
+    tol : relative interpolation error [-]
+    max_points : largest number of uniform intervals [-]
+
+    """
+    def __init__(self,nuclide_data,rho,database,r_max,tol=1e-6,max_points=2**20):
+        Ey = np.atleast_1d(np.asarray(nuclide_data.Ey,dtype=np.float64))
+        I = np.atleast_1d(np.asarray(nuclide_data.I,dtype=np.float64))
+        mu, mu_en = attenuation(Ey,rho)
+        prefac = 1/100*0.0364*(1293/(rho*1e6))*mu_en*Ey*1e-3
+        self.lines = (Ey, I*prefac*1e9*3600, mu, H10_coefficient(Ey))
+        self.database = database
+        self.r_max = float(r_max)
+        self.tol = tol
+        
+        # switching points of the build-up interpolation, at the midpoints
+        # of neighbouring and next-neighbouring tabulated mux
+        muxa = lookup_table(database)[2]
+        m = np.concatenate([(muxa[:-1]+muxa[1:])/2, (muxa[:-2]+muxa[2:])/2])
+        breaks = np.concatenate([m/mui for mui in mu])
+        breaks = breaks[(breaks > 0) & (breaks < self.r_max)]
+        breaks = np.concatenate([breaks*(1-1e-12), breaks*(1+1e-12)])
+        
+        n = 1024
+        while True:
+            r = np.unique(np.concatenate([np.linspace(0,self.r_max,n+1), breaks]))
+            f = self.exact(r)
+            fm = self.exact(0.5*(r[1:]+r[:-1]))
+            with np.errstate(divide='ignore',invalid='ignore'):
+                err = np.nan_to_num(np.abs(0.5*(f[:,1:]+f[:,:-1])-fm)/fm)
+            # the intervals across a switching point are not used
+            err[:,np.diff(r) < 1e-9*self.r_max] = 0
+            self.error = float(err.max())
+            if self.error <= tol or n >= max_points:
+                break
+            # the error of linear interpolation scales with the spacing squared
+            n = min(max_points, n*max(2, int(np.ceil(1.2*np.sqrt(self.error/tol)))))
+        self.r, self.f = r, f
+    
+    def exact(self,r):
+        """f(r) for H*(10) and D, stacked on a first axis."""
+        Ey, Ip, mu, h = self.lines
+        f = np.zeros((2,)+np.shape(r))
+        for i in range(len(Ey)):
+            mux = mu[i]*r
+            fi = Ip[i]*buildup_factor(Ey[i],mux,self.database)*np.exp(-mux)
+            f[0] += fi*h[i]
+            f[1] += fi
+        return f
+    
+    def __call__(self,r,q=1):
+        """
+        
+        Description
+        -----------
+        Interpolated point kernel q*f(r)/r**2 for H*(10) and D, zero at r=0
+        as in gamma_factors(), computed in the floating point type of r
+        (float64 for other types).
+
+        Returns
+        -------
+        K_H10 : [(nSv/h)/(Bq/m3)] for the cell volume factor q of the grid
+        K_D : [(nGy/h)/(Bq/m3)]
+
+        """
+        r = np.asarray(r)
+        if not np.issubdtype(r.dtype,np.floating):
+            r = r.astype(np.float64)
+        if np.any(r > self.r_max):
+            raise ValueError('distance beyond the table, increase r_max')
+        # the widths of the table intervals are taken in float64, as the
+        # nodes on both sides of a switching point coincide in float32
+        ra, fa = self.r.astype(r.dtype,copy=False), self.f.astype(r.dtype,copy=False)
+        dr = np.diff(self.r).astype(r.dtype,copy=False)
+        i = np.clip(np.searchsorted(self.r,r,side='right')-1,0,len(self.r)-2)
+        w = (r-ra[i])/dr[i]
+        np.clip(w,0,1,out=w)
+        scale = np.where(r==0, 0, q/np.where(r==0,1,r)**2).astype(r.dtype,copy=False)
+        K_H10 = (fa[0][i]*(1-w)+fa[0][i+1]*w)*scale
+        K_D = (fa[1][i]*(1-w)+fa[1][i+1]*w)*scale
+        return K_H10, K_D
+
+_radial_kernels = {}
+
+def cached_radial_kernel(nuclide_data,rho,database,r_max,tol=1e-6):
+    """
+    radial_kernel of the gamma lines, kept in memory per (lines, rho,
+    build-up table, tol) and rebuilt with a larger range when r_max exceeds
+    that of the kept table.
+    """
+    key = kernel_cache.kernel_key('radial_kernel', np.atleast_1d(nuclide_data.Ey),
+                                  np.atleast_1d(nuclide_data.I), float(rho),
+                                  lookup_table(database), tol)
+    kernel = _radial_kernels.get(key)
+    if kernel is None or kernel.r_max < r_max:
+        r_max = r_max if kernel is None else max(r_max,2*kernel.r_max)
+        kernel = radial_kernel(nuclide_data,rho,database,r_max,tol)
+        _radial_kernels[key] = kernel
+    return kernel
+
+def radial_gamma_factors(grid,xq,yq,zq,nuclide_data,rho,database,tol=1e-6,max_memory=2**28,out=None,dtype=np.float64):
+    """
+    
+    Description
+    -----------
+    Same as gamma_factors_many(), but from the radial_kernel table of the
+    gamma lines (see cached_radial_kernel()): per detector, only the
+    distances to the cells and a 1D interpolation are computed, whatever the
+    number of gamma lines. The factors agree with gamma_factors_many() to
+    within tol relative.
+
+    Parameters
+    ----------
+    see gamma_factors_many()
+    tol : relative interpolation error of the table [-]
+
+    Returns
+    -------
+    gf_H10, gf_D : see gamma_factors_many()
+
+    """
+    xq = np.atleast_1d(np.asarray(xq,dtype=np.float64))
+    yq = np.atleast_1d(np.asarray(yq,dtype=np.float64))
+    zq = np.atleast_1d(np.asarray(zq,dtype=np.float64))
+    q = grid.dx*grid.dy*grid.dz/3.7e10
+    shape = grid_shape(grid)
+    ground = np.broadcast_to(grid.Z==0,shape)
+    
+    # largest distance between a detector and a corner of the grid
+    corners = [np.array([np.min(v),np.max(v)]) for v in (grid.X,grid.Y,grid.Z)]
+    r_max = max(np.sqrt(np.max((corners[0]-xj)**2)+np.max((corners[1]-yj)**2)+np.max((corners[2]-zj)**2))
+                for xj, yj, zj in zip(xq,yq,zq))
+    kernel = cached_radial_kernel(nuclide_data,rho,database,1.01*r_max,tol)
+    
+    if out is None:
+        gf_H10 = np.zeros((len(xq),)+shape,dtype=dtype)
+        gf_D = np.zeros((len(xq),)+shape,dtype=dtype)
+    else:
+        gf_H10, gf_D = as_array(out[0]), as_array(out[1])
+    
+    # about 6 grid-sized temporaries per detector in a chunk, in the type of
+    # the factors
+    dtype = gf_H10.dtype
+    chunk = max(1, int(max_memory//(6*np.dtype(dtype).itemsize*np.prod(shape))))
+    for j0 in range(0, len(xq), chunk):
+        j1 = min(j0+chunk, len(xq))
+        xj = xq[j0:j1,None,None,None]
+        yj = yq[j0:j1,None,None,None]
+        zj = zq[j0:j1,None,None,None]
+        r = np.sqrt((grid.X-xj)**2+(grid.Y-yj)**2+(grid.Z-zj)**2).astype(dtype,copy=False)
+        K_H10, K_D = kernel(r,q)
+        K_H10[:,ground] = K_H10[:,ground]/2
+        K_D[:,ground] = K_D[:,ground]/2
+        gf_H10[j0:j1] = K_H10
+        gf_D[j0:j1] = K_D
+    return gf_H10, gf_D
+
+def cached_gamma_factors(grid,xq,yq,zq,nuclide_data,rho,database,cache_dir=None,max_size=kernel_cache.default_max_size):
+    """
+    
+    Description
+    -----------
+    Same as gamma_factors(), but the result is stored in an on-disk cache
+    (see kernel_cache.py), keyed by a hash of the grid axes, the detector
+    position, the gamma lines, rho and the build-up factor table. Later calls
+    with the same inputs load the factors memory-mapped instead of
+    recomputing them.
+
+    Parameters
+    ----------
+    see gamma_factors()
+    cache_dir : cache directory, kernel_cache.default_cache_dir if None
+    max_size : maximum total size of the cache [bytes]
+
+    Returns
+    -------
+    gf_H10 : Ambient dose equivalent rate contributions of all grid cells for a
+    unit release (read-only) [(nSv/h)/(Bq/m3)]
+    gf_D : Gamma dose rate to air contributions of all grid cells for a
+    unit release (read-only) [(nGy/h)/(Bq/m3)]
+
+    """
+    key = kernel_key(grid,xq,yq,zq,nuclide_data,rho,database)
+    gf = kernel_cache.load_kernel(key,cache_dir)
+    if gf is None:
+        gf = np.stack(gamma_factors(grid,xq,yq,zq,nuclide_data,rho,database))
+        kernel_cache.save_kernel(key,gf,cache_dir,max_size)
+        gf.setflags(write=False)
+    return gf[0], gf[1]
+
+def kernel_key(grid,xq,yq,zq,nuclide_data,rho,database):
+    """
+    Key of the gamma factors of a detector in the kernel cache. The build-up
+    factor table itself is hashed, so that user-registered tables are safe.
+    """
+    axes = (grid.X[0,:,0], grid.Y[:,0,0], grid.Z[0,0,:])
+    return kernel_cache.kernel_key('gamma_factors', 1, axes,
+                                   float(xq), float(yq), float(zq),
+                                   np.atleast_1d(nuclide_data.Ey),
+                                   np.atleast_1d(nuclide_data.I),
+                                   float(rho), lookup_table(database))
+
+def time_resolved_H10(grid,xq,yq,zq,c,nuclide_data,rho,database,cache=False):
+    """
+    
+    Description
+    -----------
+    Ambient dose equivalent rate and air kerma rate at a detector for all
+    timesteps of c, see gamma_factors().
+
+    Parameters
+    ----------
+    see gamma_factors()
+    c : 4D array of concentrations with time on the last axis [Bq/m3]
+    cache : True to use cached_gamma_factors() with the default cache
+    directory, or the path of a cache directory [-]
+
+    Returns
+    -------
+    H10 : Ambient dose equivalent rate for every timestep [nSv/h]
+    D : Gamma dose rate to air for every timestep [nGy/h]
+
+    """
+    if cache:
+        cache_dir = None if cache is True else cache
+        gf_H10,gf_D = cached_gamma_factors(grid, xq, yq, zq, nuclide_data, rho, database, cache_dir)
+    else:
+        gf_H10,gf_D = gamma_factors(grid, xq, yq, zq, nuclide_data, rho, database)
+    H10, D = dose_rate_series(gf_H10,gf_D,c)
     return H10, D
+
+def time_resolved_H10_many(grid,xq,yq,zq,c,nuclide_data,rho,database,cache=False,chunk_size=None,dtype=np.float64):
+    """
+    
+    Description
+    -----------
+    Same as time_resolved_H10(), but for several detectors at once: the gamma
+    factors are computed with gamma_factors_many() (or loaded from the cache)
+    and the dose rates of all detectors and timesteps follow from a single
+    contraction, see dose_rate_series().
+
+    Parameters
+    ----------
+    see gamma_factors_many()
+    c : 4D array of concentrations with time on the last axis [Bq/m3]
+    cache : True to use cached_gamma_factors() with the default cache
+    directory, or the path of a cache directory [-]
+    chunk_size : see dose_rate_series()
+    dtype : precision of the gamma factors if they are not cached, see
+    gamma_factors_many(). The dose rates are summed in float64.
+
+    Returns
+    -------
+    H10 : Ambient dose equivalent rate, shape (n_detectors, Nt) [nSv/h]
+    D : Gamma dose rate to air, shape (n_detectors, Nt) [nGy/h]
+
+    """
+    if cache:
+        cache_dir = None if cache is True else cache
+        gf = [cached_gamma_factors(grid, xq[i], yq[i], zq[i], nuclide_data, rho, database, cache_dir)
+              for i in range(len(xq))]
+        gf_H10 = np.stack([gfi[0] for gfi in gf])
+        gf_D = np.stack([gfi[1] for gfi in gf])
+    else:
+        gf_H10,gf_D = gamma_factors_many(grid, xq, yq, zq, nuclide_data, rho, database, dtype=dtype)
+    H10, D = dose_rate_series(gf_H10,gf_D,c,chunk_size)
+    return H10, D
+
+chunk_bytes = 2**25 # size of the float64 blocks of c in dose_rate_series()
+
+def dose_rate_series(gf_H10,gf_D,c,chunk_size=None,out=None):
+    """
+    
+    Description
+    -----------
+    Contracts gamma factors with a time series of concentration fields:
+        
+        H10[j,n] = sum(gf_H10[j]*c[:,:,:,n])
+    
+    for all detectors j and timesteps n, and the same for D. The grid axes are
+    flattened so that both quantities for all detectors follow from a single
+    matrix product of shape (2*n_detectors, Ncells) x (Ncells, Nt). Apart from
+    the stacked factors, the memory use is that of the result. If chunk_size
+    is given, the grid cells are processed in blocks of that many cells, which
+    bounds how much of a memory-mapped c is read at once. The sums are
+    always computed in float64, also for float32 factors or fields; a float32
+    or non-contiguous c is then processed in blocks of about chunk_bytes that
+    are cast one at a time, never as a whole.
+
+    Parameters
+    ----------
+    gf_H10 : H*(10) gamma factors, shape (n_detectors, Ny, Nx, Nz) or
+    (Ny, Nx, Nz) for a single detector [(nSv/h)/(Bq/m3)]
+    gf_D : Air kerma gamma factors, same shape as gf_H10 [(nGy/h)/(Bq/m3)]
+    c : 4D array of concentrations with time on the last axis [Bq/m3]
+    chunk_size : Number of grid cells per block, None for a single block [-]
+    out : optional tuple of output arrays (H10, D), see gamma_factors_many()
+
+    Returns
+    -------
+    H10 : Ambient dose equivalent rate, shape (n_detectors, Nt) or (Nt,)
+    [nSv/h]
+    D : Gamma dose rate to air, shape (n_detectors, Nt) or (Nt,) [nGy/h]
+
+    """
+    single = np.ndim(gf_H10) == np.ndim(c)-1
+    Ncells = np.prod(c.shape[:-1])
+    Nt = c.shape[-1]
+    G = np.concatenate([np.reshape(gf_H10,(-1,Ncells)), np.reshape(gf_D,(-1,Ncells))],dtype=np.float64)
+    direct = c.dtype == np.float64 and c.flags.c_contiguous
+    if chunk_size is None and direct:
+        HD = G @ np.reshape(c,(Ncells,Nt))
+    else:
+        # blocks of cells are cast to float64 one at a time, so that a
+        # float32 or strided c is never copied as a whole
+        if chunk_size is None:
+            chunk_size = max(1, chunk_bytes//(8*Nt))
+        HD = np.zeros((G.shape[0],Nt))
+        if c.flags.c_contiguous:
+            C = np.reshape(c,(Ncells,Nt))
+            for i0 in range(0,Ncells,chunk_size):
+                HD += G[:,i0:i0+chunk_size] @ np.asarray(C[i0:i0+chunk_size],dtype=np.float64)
+        else:
+            # whole slabs of the first grid axis, reshaping a strided slab
+            # copies only that slab
+            slab = Ncells//c.shape[0]
+            step = max(1, chunk_size//slab)
+            for k0 in range(0,c.shape[0],step):
+                k1 = min(k0+step,c.shape[0])
+                Cb = np.reshape(np.asarray(c[k0:k1],dtype=np.float64),(-1,Nt))
+                HD += G[:,k0*slab:k1*slab] @ Cb
+    n = G.shape[0]//2
+    H10, D = HD[:n], HD[n:]
+    if single:
+        H10, D = H10[0], D[0]
+    if out is not None:
+        as_array(out[0])[...] = H10
+        as_array(out[1])[...] = D
+        H10, D = as_array(out[0]), as_array(out[1])
+    return H10, D
+
+class dose_rate_accumulator(object):
+    """
+    
+    Description
+    -----------
+    Consumer for gaussian_plume.stream_plume() that computes the dose rates of
+    dose_rate_series() one timestep at a time, so that the 4D concentration
+    array is never needed. After the run, H10 and D hold the dose rates with
+    shape (n_detectors, Nt), or (Nt,) for the factors of a single detector.
+
+    Parameters
+    ----------
+    gf_H10 : H*(10) gamma factors, see dose_rate_series() [(nSv/h)/(Bq/m3)]
+    gf_D : Air kerma gamma factors, see dose_rate_series() [(nGy/h)/(Bq/m3)]
+    Nt : Number of timesteps [-]
+
+    """
+    def __init__(self,gf_H10,gf_D,Nt):
+        Ncells = np.shape(gf_H10)[-3]*np.shape(gf_H10)[-2]*np.shape(gf_H10)[-1]
+        self.G = np.concatenate([np.reshape(gf_H10,(-1,Ncells)), np.reshape(gf_D,(-1,Ncells))],dtype=np.float64)
+        self.n = self.G.shape[0]//2
+        shape = (Nt,) if np.ndim(gf_H10) == 3 else (self.n,Nt)
+        self.H10 = np.zeros(shape)
+        self.D = np.zeros(shape)
+    
+    def __call__(self,i,ci):
+        out = self.G @ np.reshape(ci,-1)
+        self.H10[...,i] = out[:self.n] if self.H10.ndim == 2 else out[0]
+        self.D[...,i] = out[self.n:] if self.D.ndim == 2 else out[self.n]
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache for arrays that only depend on a few inputs, such as
+the gamma factors of a detector (see gamma_dosimetry.cached_gamma_factors()).
+
+Every array is stored as a .npy file whose name is a hash of the inputs it
+was computed from, so that changing any input simply results in a new entry.
+Entries are loaded memory-mapped and the least recently used ones are evicted
+once the cache grows beyond its maximum size.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+default_cache_dir = os.path.join(os.path.dirname(__file__), 'data', 'cache')
+default_max_size = 2*1024**3 # bytes
+
+def kernel_key(*inputs):
+    """
+    
+    Description
+    -----------
+    Hashes the inputs into a key. Arrays are hashed by dtype, shape and
+    content, other inputs by their repr().
+
+    Parameters
+    ----------
+    inputs : numbers, strings, arrays or (nested) tuples/lists of those
+
+    Returns
+    -------
+    key : hexadecimal SHA-256 digest
+
+    """
+    h = hashlib.sha256()
+    _update(h, inputs)
+    return h.hexdigest()
+
+def _update(h, x):
+    if isinstance(x, np.ndarray):
+        x = np.ascontiguousarray(x)
+        h.update(('ndarray%s%s' % (x.dtype.str, x.shape)).encode())
+        h.update(x.tobytes())
+    elif isinstance(x, (tuple, list)):
+        h.update(('seq%d' % len(x)).encode())
+        for xi in x:
+            _update(h, xi)
+    else:
+        h.update(repr(x).encode())
+        h.update(b';')
+
+def kernel_path(key, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    return os.path.join(cache_dir, key + '.npy')
+
+def load_kernel(key, cache_dir=None, mmap_mode='r'):
+    """
+    
+    Description
+    -----------
+    Loads a cached array, memory-mapped by default.
+
+    Parameters
+    ----------
+    key : key of the array, see kernel_key()
+    cache_dir : cache directory, default_cache_dir if None
+    mmap_mode : passed to np.load(), None to read the array into memory
+
+    Returns
+    -------
+    array : the cached array or None if the key is not in the cache
+
+    """
+    path = kernel_path(key, cache_dir)
+    try:
+        array = np.load(path, mmap_mode=mmap_mode)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    # the access time is not reliable on all file systems; a read-only
+    # cache still serves its entries, only their recency is not updated
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return array
+
+def save_kernel(key, array, cache_dir=None, max_size=default_max_size):
+    """
+    
+    Description
+    -----------
+    Stores an array in the cache and evicts the least recently used entries
+    if the cache is larger than max_size. The file is written under a
+    temporary name first so that concurrent readers never see partial files.
+
+    Parameters
+    ----------
+    key : key of the array, see kernel_key()
+    array : array to store
+    cache_dir : cache directory, default_cache_dir if None
+    max_size : maximum total size of the cache [bytes]
+
+    """
+    path = kernel_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+    evict(os.path.dirname(path), max_size, keep=path)
+
+def evict(cache_dir=None, max_size=default_max_size, keep=None):
+    """
+    
+    Description
+    -----------
+    Removes the least recently used entries until the total size of the cache
+    is at most max_size. The entry keep is never removed.
+
+    Parameters
+    ----------
+    cache_dir : cache directory, default_cache_dir if None
+    max_size : maximum total size of the cache [bytes]
+    keep : path of an entry that should not be removed
+
+    Returns
+    -------
+    removed : list of removed paths
+
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    entries = []
+    for f in os.listdir(cache_dir):
+        if f.endswith('.npy'):
+            path = os.path.join(cache_dir, f)
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(e[1] for e in entries)
+    removed = []
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # removed concurrently, or still mapped on Windows
+            continue
+        total -= size
+        removed.append(path)
+    return removed
+
+def clear(cache_dir=None):
+    """Removes all entries from the cache."""
+    return evict(cache_dir, max_size=-1)
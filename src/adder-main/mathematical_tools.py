@@ -6,6 +6,7 @@
 """
 
 import numpy as np
+from scipy.optimize import lsq_linear
 
 class data_collection(object):
     pass
@@ -14,7 +15,60 @@ def instance_of_data_collection():
     instance = data_collection()
     return instance
 
-def create_square_centered_grid(bx,by,bz,Nx,Ny,Nz):
+class compact_grid(data_collection):
+    """
+    Grid that only stores its 1D axes x, y and z, the spacings dx, dy, dz and
+    the numbers of cells Nx, Ny, Nz. X, Y and Z are broadcastable views of
+    the axes of shapes (1,Nx,1), (Ny,1,1) and (1,1,Nz), i.e. a sparse
+    np.meshgrid, so that the grid takes O(Nx+Ny+Nz) memory and arithmetic
+    on it only broadcasts to the full (Ny,Nx,Nz) shape when it combines
+    the three axes. It can be used wherever a grid of
+    create_square_centered_grid(sparse=False) is accepted.
+    """
+    def __init__(self,x,y,z,dx=1,dy=1,dz=1):
+        self.x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        self.y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        self.z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        self.dx, self.dy, self.dz = dx, dy, dz
+        self.Nx, self.Ny, self.Nz = len(self.x), len(self.y), len(self.z)
+    
+    @property
+    def X(self):
+        return self.x[None,:,None]
+    
+    @property
+    def Y(self):
+        return self.y[:,None,None]
+    
+    @property
+    def Z(self):
+        return self.z[None,None,:]
+    
+    @property
+    def shape(self):
+        return (self.Ny,self.Nx,self.Nz)
+    
+    @property
+    def size(self):
+        return self.Ny*self.Nx*self.Nz
+    
+    def dense(self):
+        """Returns the same grid with full X, Y and Z meshgrids."""
+        grid = instance_of_data_collection()
+        grid.dx, grid.dy, grid.dz = self.dx, self.dy, self.dz
+        grid.Nx, grid.Ny, grid.Nz = self.Nx, self.Ny, self.Nz
+        grid.X,grid.Y,grid.Z = np.meshgrid(self.x,self.y,self.z)
+        add_polar_coordinates(grid)
+        return grid
+
+def grid_shape(grid):
+    """
+    Shape of the fields on a grid, for full meshgrids, compact_grid and
+    receptor grids (see receptors.receptor_grid()) alike.
+    """
+    return np.broadcast_shapes(np.shape(grid.X),np.shape(grid.Y),np.shape(grid.Z))
+
+def create_square_centered_grid(bx,by,bz,Nx,Ny,Nz,sparse=False):
     """
     Parameters
     ----------
@@ -30,11 +84,14 @@ def create_square_centered_grid(bx,by,bz,Nx,Ny,Nz):
         Number of cells in y direction.
     Nz : INT
         Number of cells in z direction.
+    sparse : BOOL
+        If True, return a compact_grid that only stores the 1D axes.
 
     Returns
     -------
     grid : DATA_COLLECTION
-        Contains X, Y and Z meshgrids and various grid parameters.
+        Contains X, Y and Z meshgrids, the polar coordinates of the horizontal
+        plane (see add_polar_coordinates) and various grid parameters.
     """
     grid = instance_of_data_collection()
     if Nx > 1:
@@ -55,10 +112,32 @@ def create_square_centered_grid(bx,by,bz,Nx,Ny,Nz):
     else:
         grid.dz = 1
         z = bz
+    if sparse:
+        grid = compact_grid(x,y,z,grid.dx,grid.dy,grid.dz)
+        add_polar_coordinates(grid)
+        return grid
     grid.Nx = Nx
     grid.Ny = Ny
     grid.Nz = Nz
     grid.X,grid.Y,grid.Z = np.meshgrid(x,y,z)
+    add_polar_coordinates(grid)
+    return grid
+
+def add_polar_coordinates(grid):
+    """
+    Caches the polar coordinates of the horizontal plane of the grid, i.e.
+    grid.r, grid.phi and the tables grid.cosphi and grid.sinphi, so that
+    rotate_polar() needs no square roots or trigonometric functions per cell.
+    For meshgrids they have a single z layer (shape (Ny,Nx,1)) and broadcast
+    against Z, otherwise they have the shape of grid.X.
+    """
+    X, Y = grid.X, grid.Y
+    if np.ndim(X) == 3:
+        X, Y = X[:,:,:1], Y[:,:,:1]
+    grid.r = np.sqrt(X**2+Y**2)
+    grid.phi = np.arctan2(Y,X)
+    grid.cosphi = np.cos(grid.phi)
+    grid.sinphi = np.sin(grid.phi)
     return grid
 
 def wind_statistics(wd):
@@ -210,6 +289,37 @@ def find_nearest(vec,val):
     
     return idx
 
+def find_nearest_many(vec,val):
+    """
+    Parameters
+    ----------
+    vec : sorted vector of values
+    val : array of values with respect to which neighbours are calculated
+
+    Returns
+    -------
+    idxl : indices of the nearest neighbours of val in vec
+    idxu : indices of the second-nearest neighbours of val in vec
+    
+    Batched version of find_nearest(): for every element of val it returns the
+    same pair of indices (including the tie-breaking towards the lower index),
+    without modifying vec.
+
+    """
+    vec = np.asarray(vec)
+    val = np.asarray(val)
+    n   = len(vec)
+    k   = np.clip(np.searchsorted(vec,val),1,n-1)
+    dlo = np.abs(vec[k-1]-val)
+    dhi = np.abs(vec[k]-val)
+    idxl = np.where(dlo <= dhi, k-1, k)
+    
+    dm  = np.where(idxl >= 1, np.abs(vec[np.maximum(idxl-1,0)]-val), np.inf)
+    dp  = np.where(idxl <= n-2, np.abs(vec[np.minimum(idxl+1,n-1)]-val), np.inf)
+    idxu = np.where(dm <= dp, idxl-1, idxl+1)
+    
+    return idxl, idxu
+
 def yx_to_wd(x,y):
     wd = np.mod(-(np.arctan2(y,x)*180/np.pi-90-180),360)
     r = np.sqrt(x**2+y**2)
@@ -233,4 +343,71 @@ def rotate_grid(X,Y,wd):
     Xrot = r*np.cos(phi)
     Yrot = r*np.sin(phi)
     
-    return Xrot,Yrot
\ No newline at end of file
+    return Xrot,Yrot
+
+def rotate_polar(grid,wd):
+    """
+    Parameters
+    ----------
+    grid : Grid with cached polar coordinates, see add_polar_coordinates()
+    (they are added if missing)
+    wd: Wind direction (antiparallel to wind vector) [deg. w.r.t. North],
+    a vector of wind directions is broadcast against a trailing axis
+
+    Returns
+    -------
+    Xrot,Yrot : X and Y components of the grid rotated as in rotate_grid(),
+    evaluated as r*cos(phi+theta) and r*sin(phi+theta) from the cached
+    tables. Upwind cells (Xrot <= 0), where there is no plume, are masked
+    with NaN.
+
+    """
+    if not hasattr(grid,'r'):
+        add_polar_coordinates(grid)
+    theta = np.asarray(-np.pi + (wd-90)/180*np.pi)
+    r, cosphi, sinphi = grid.r, grid.cosphi, grid.sinphi
+    if theta.ndim > 0:
+        r, cosphi, sinphi = r[...,None], cosphi[...,None], sinphi[...,None]
+    ct, st = np.cos(theta), np.sin(theta)
+    Xrot = r*(cosphi*ct - sinphi*st)
+    Yrot = r*(sinphi*ct + cosphi*st)
+    Xrot[Xrot <= 0] = np.nan
+    
+    return Xrot,Yrot
+
+def bounded_least_squares(A,b,lower=0.,upper=np.inf,max_iter=None):
+    """
+    Parameters
+    ----------
+    A : matrix, shape (m, n)
+    b : vector, shape (m,)
+    lower, upper : bounds of the solution, scalars or vectors of length n
+    (-np.inf, np.inf for no bound); lower=0 and upper=np.inf give
+    non-negative least squares
+    max_iter : largest number of iterations, see scipy.optimize.lsq_linear()
+
+    Returns
+    -------
+    x : solution of min ||A x - b|| subject to lower <= x <= upper
+    free : whether each element of x is not held at one of its bounds
+    status : convergence status of scipy.optimize.lsq_linear(), positive if
+    the solver converged
+
+    Bounded-variable least squares (Stark and Parker, 1995), see
+    scipy.optimize.lsq_linear() with method='bvls'.
+
+    """
+    A = np.asarray(A,dtype=np.float64)
+    b = np.asarray(b,dtype=np.float64)
+    n = A.shape[1]
+    lower = np.broadcast_to(np.asarray(lower,dtype=np.float64),(n,))
+    upper = np.broadcast_to(np.asarray(upper,dtype=np.float64),(n,))
+    if np.any(lower > upper):
+        raise ValueError('lower bounds should not exceed upper bounds')
+    if np.all(lower == upper):
+        return lower.copy(), np.zeros(n,dtype=bool), 1
+    result = lsq_linear(A,b,bounds=(lower,upper),method='bvls',tol=1e-12,max_iter=max_iter)
+    free = result.active_mask == 0
+    x = np.where(result.active_mask < 0, lower, np.where(result.active_mask > 0, upper, result.x))
+    x = np.clip(x,lower,upper)
+    return x, free, result.status
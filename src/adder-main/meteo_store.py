@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar store of meteo mast data, so that time windows of long archives
+(many daily CSV files such as data/meteo/met20190515.txt) are read without
+parsing CSV.
+
+The CSV files are ingested once into a directory with:
+    - t.npy : sorted time index (datetime64[ns]);
+    - <column>.npy : one array per CSV column, in the order of t;
+    - meta.json : columns and name, size and mtime of the ingested files.
+
+A time window is found by binary search in the memory-mapped time index and
+only the rows of the window are read from the memory-mapped columns. Files
+can be added to a store later; rows of a file that was modified are
+replaced, and duplicate times keep the row of the last ingested file.
+
+Typical use:
+    store = meteo_store.create('data/cache/mast', glob.glob('archive/met*.txt'))
+    ...
+    meteo = meteo_store.open('data/cache/mast').meteo(t0, t1)
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import kernel_cache
+from mathematical_tools import instance_of_data_collection
+
+time_column = 'Date_Time'
+time_format = '%Y-%m-%d %H:%M:%S'
+default_directory = os.path.join(os.path.dirname(__file__), 'data', 'meteo')
+
+def read_mast_csv(filepath):
+    """
+    Reads a mast CSV file into a dict of column arrays, with the times of
+    time_column under 't' as datetime64[ns].
+    """
+    data = pd.read_csv(filepath,sep=';')
+    columns = {'t': pd.to_datetime(data[time_column],format=time_format).to_numpy().astype('datetime64[ns]')}
+    for name in data.columns:
+        if name == time_column:
+            continue
+        v = data[name].to_numpy()
+        columns[name] = v.astype(str) if v.dtype == object or not np.issubdtype(v.dtype,np.number) else v
+    return columns
+
+def file_signature(filepath):
+    st = os.stat(filepath)
+    return [os.path.abspath(filepath), st.st_size, st.st_mtime_ns]
+
+class meteo_store(object):
+    """
+
+    Description
+    -----------
+    Memory-mapped columnar store of meteo mast data with a sorted time index.
+    Use meteo_store.create() to ingest CSV files into a new store and
+    meteo_store.open() to read an existing one.
+
+    """
+    def __init__(self,path):
+        self.path = path
+        with open(os.path.join(path,'meta.json')) as f:
+            self.meta = json.load(f)
+        self.t = np.load(os.path.join(path,'t.npy'),mmap_mode='r')
+
+    @classmethod
+    def create(cls,path,files):
+        """Creates a store at path from a list of mast CSV files."""
+        os.makedirs(path,exist_ok=True)
+        with open(os.path.join(path,'meta.json'),'w') as f:
+            json.dump({'version': 1, 'columns': [], 'files': []},f)
+        np.save(os.path.join(path,'t.npy'),np.array([],dtype='datetime64[ns]'))
+        store = cls(path)
+        store.ingest(files)
+        return store
+
+    @classmethod
+    def open(cls,path):
+        return cls(path)
+
+    def __len__(self):
+        return len(self.t)
+
+    @property
+    def columns(self):
+        return list(self.meta['columns'])
+
+    @property
+    def files(self):
+        return [f[0] for f in self.meta['files']]
+
+    def column(self,name):
+        """Memory-mapped column, 't' for the time index."""
+        if name == 't':
+            return self.t
+        if name not in self.meta['columns']:
+            raise KeyError(name)
+        return np.load(os.path.join(self.path,name+'.npy'),mmap_mode='r')
+
+    def ingest(self,files):
+        """
+
+        Description
+        -----------
+        Adds mast CSV files to the store. Files that were ingested before and
+        did not change are skipped. If an ingested file changed, the store is
+        rebuilt from all its files.
+
+        Parameters
+        ----------
+        files : list of paths of CSV files
+
+        Returns
+        -------
+        ingested : list of the files that were read
+
+        """
+        signatures = {f[0]: f for f in self.meta['files']}
+        new = [file_signature(f) for f in files]
+        changed = [s for s in new if s[0] in signatures and signatures[s[0]] != s]
+        if changed:
+            for s in new:
+                signatures[s[0]] = s
+            keep = [s for s in signatures.values() if os.path.exists(s[0])]
+            read, tables = keep, []
+        else:
+            read = [s for s in new if s[0] not in signatures]
+            keep = self.meta['files'] + read
+            tables = [{name: np.asarray(self.column(name)) for name in ['t']+self.columns}] if len(self) else []
+        if not read:
+            return []
+        tables += [read_mast_csv(s[0]) for s in read]
+
+        columns = [name for name in tables[0] if name != 't']
+        for table in tables:
+            if sorted(table) != sorted(['t']+columns):
+                raise ValueError('the mast files should all have the same columns')
+        merged = {name: np.concatenate([table[name] for table in tables]) for name in ['t']+columns}
+        # sort by time, keeping the last ingested row of duplicate times
+        order = np.argsort(merged['t'][::-1],kind='stable')
+        t = merged['t'][::-1][order]
+        first = np.concatenate([[True],t[1:] != t[:-1]])
+        rows = (len(t)-1-order)[first]
+
+        for name in ['t']+columns:
+            _save(os.path.join(self.path,name+'.npy'),merged[name][rows])
+        self.meta['columns'] = columns
+        self.meta['files'] = keep
+        with open(os.path.join(self.path,'meta.json'),'w') as f:
+            json.dump(self.meta,f,indent=1)
+        self.t = np.load(os.path.join(self.path,'t.npy'),mmap_mode='r')
+        return [s[0] for s in read]
+
+    def window(self,t0,t1):
+        """Row range i0:i1 of the times t0 <= t <= t1, by binary search."""
+        i0 = np.searchsorted(self.t,np.datetime64(t0,'ns'),side='left')
+        i1 = np.searchsorted(self.t,np.datetime64(t1,'ns'),side='right')
+        return int(i0), int(max(i0,i1))
+
+    def read(self,t0,t1,columns=None):
+        """
+        Memory-mapped slices of the given columns (all by default) and of the
+        time index 't' for the window t0 <= t <= t1, as a dict.
+        """
+        i0, i1 = self.window(t0,t1)
+        if columns is None:
+            columns = self.columns
+        return {name: self.column(name)[i0:i1] for name in ['t']+list(columns)}
+
+    def meteo(self,t0,t1,Href=69,T=10):
+        """
+
+        Description
+        -----------
+        Meteo data of the window t0 <= t <= t1 in the form of
+        read_inputs.read_selenium_meteo(): the air temperature at the stack
+        height of 60 m is interpolated between the masts at 8 and 114 m.
+
+        Parameters
+        ----------
+        t0, t1 : first and last time of the window
+        Href : height of the wind measurement [m]
+        T : averaging time of the data [minutes]
+
+        Returns
+        -------
+        meteo : class of type data_collection with t, T8, T114, Href, Ta, U,
+        wd, sig_wd, E and T
+
+        """
+        data = self.read(t0,t1,['T8','T114','Speed','Azimuth','AzimSigma','E_dT'])
+        meteo       = instance_of_data_collection()
+        meteo.t     = np.array(data['t'])
+        meteo.T8    = np.array(data['T8'])
+        meteo.T114  = np.array(data['T114'])
+        meteo.Href  = Href
+        meteo.Ta    = meteo.T8 + (meteo.T114-meteo.T8)/(114-8)*(60-8)
+        meteo.U     = np.array(data['Speed'])
+        meteo.wd    = np.array(data['Azimuth'])
+        meteo.sig_wd= np.array(data['AzimSigma'])
+        meteo.E     = np.array(data['E_dT'])
+        meteo.T     = T
+        return meteo
+
+def _save(path,array):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp,'wb') as f:
+        np.save(f,array)
+    os.replace(tmp,path)
+
+def mast_store(directory=None,path=None):
+    """
+
+    Description
+    -----------
+    Store of all mast CSV files (*.txt) of directory, data/meteo by default,
+    kept in the cache directory. Files that were added or modified since the
+    last call are ingested first.
+
+    Parameters
+    ----------
+    directory : directory of the CSV files
+    path : directory of the store, by default under
+    kernel_cache.default_cache_dir
+
+    Returns
+    -------
+    store : meteo_store
+
+    """
+    if directory is None:
+        directory = default_directory
+    if path is None:
+        key = kernel_cache.kernel_key('meteo_store', 1, os.path.abspath(directory))
+        path = os.path.join(kernel_cache.default_cache_dir, 'meteo-%s' % key[:16])
+    files = sorted(glob.glob(os.path.join(directory,'*.txt')))
+    if not os.path.exists(os.path.join(path,'meta.json')):
+        return meteo_store.create(path,files)
+    store = meteo_store.open(path)
+    store.ingest(files)
+    return store
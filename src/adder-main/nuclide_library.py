@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Library of the LARA nuclide sheets in data/nuclides (see read_inputs.read_lara()).
+All sheets are parsed once into a compact binary cache (data/cache/
+nuclides-*.npz) holding the gamma energies and intensities of every nuclide
+together with its element, half-life and daughters. The cache is rebuilt
+when a sheet is added, removed or modified (by name, size and mtime), so
+that looking up nuclides normally costs a directory listing and one small
+file read per process.
+
+Nuclides are looked up by their exact LARA name, e.g. 'Se-75', 'Ba-137m',
+so metastable states are distinct from their ground state. Several nuclides
+can be looked up at once, optionally with the gamma lines of their
+daughters in secular equilibrium, and mixture() combines them into a single
+set of lines for multi-nuclide source terms.
+"""
+
+import json
+import os
+
+import numpy as np
+
+import kernel_cache
+from mathematical_tools import instance_of_data_collection
+
+default_directory = os.path.join(os.path.dirname(__file__), 'data', 'nuclides')
+cache_version = 1
+
+missing_message = ('This nuclide is not yet included in data/nuclides. Go to '
+                   'http://www.nucleide.org/Laraweb/index.php and download '
+                   'the data and emissions file in ASCII text format, e.g. '
+                   'Se-75.lara.txt. Put it in the folder and rerun.')
+
+def parse_lara(filepath):
+    """
+
+    Description
+    -----------
+    Parses a LARA sheet (data and emissions, ASCII text format) without
+    pandas. Only the gamma lines (Type 'g') of the emission table are kept,
+    in the order of the sheet.
+
+    Parameters
+    ----------
+    filepath : path of the sheet
+
+    Returns
+    -------
+    entry : dict with nuclide, element, half_life [s] (None if not given),
+    daughters (list of [name, branching fraction]), Ey [keV] and I [0-1]
+
+    """
+    entry = {'nuclide': None, 'element': None, 'half_life': None,
+             'daughters': [], 'Ey': [], 'I': []}
+    with open(filepath) as file:
+        lines = file.read().splitlines()
+
+    columns = None
+    for k, line in enumerate(lines):
+        fields = [f.strip() for f in line.split(';')]
+        if columns is not None:
+            if line.startswith('=='):
+                break
+            row = dict(zip(columns, fields))
+            if row.get('Type') == 'g':
+                entry['Ey'].append(float(row['Energy (keV)']))
+                entry['I'].append(float(row['Intensity (%)'])/100) # to fractions
+        elif line.startswith('--'):
+            columns = [f.strip() for f in lines[k+1].split(';')]
+            lines[k+1] = ''
+        elif fields[0] == 'Nuclide':
+            entry['nuclide'] = fields[1]
+        elif fields[0] == 'Element':
+            entry['element'] = fields[1]
+        elif fields[0] == 'Half-life (s)':
+            entry['half_life'] = float(fields[1])
+        elif fields[0] == 'Daughter(s)':
+            # decay modes in brackets, then pairs of name and branching (%)
+            tokens = [f for f in fields[1:] if f and not f.startswith('(')]
+            entry['daughters'] = [[tokens[i], float(tokens[i+1])/100]
+                                  for i in range(0, len(tokens)-1, 2)]
+    if entry['nuclide'] is None:
+        entry['nuclide'] = os.path.basename(filepath).split('.')[0]
+    return entry
+
+class nuclide_library(object):
+    """
+
+    Description
+    -----------
+    Parsed LARA sheets of a directory, loaded from or stored in a binary
+    cache. Use default_library() for the sheets in data/nuclides.
+
+    Parameters
+    ----------
+    directory : directory of the LARA sheets, data/nuclides by default
+    cache_dir : directory of the cache file, kernel_cache.default_cache_dir
+    by default, False to parse the sheets without caching
+
+    """
+    def __init__(self,directory=None,cache_dir=None):
+        self.directory = default_directory if directory is None else directory
+        if cache_dir is None:
+            cache_dir = kernel_cache.default_cache_dir
+        self.cache_dir = cache_dir
+        self.entries = self._load()
+
+    @property
+    def names(self):
+        return sorted(self.entries)
+
+    def __contains__(self,nuclide):
+        return nuclide in self.entries
+
+    def __getitem__(self,nuclide):
+        return self.lookup([nuclide])[0]
+
+    def signature(self):
+        """Name, size and mtime of every sheet of the directory."""
+        signature = []
+        for f in sorted(os.scandir(self.directory), key=lambda f: f.name):
+            if f.is_file() and f.name.endswith('.txt'):
+                st = f.stat()
+                signature.append([f.name, st.st_size, st.st_mtime_ns])
+        return signature
+
+    def _cache_path(self):
+        key = kernel_cache.kernel_key('nuclide_library', cache_version,
+                                      os.path.abspath(self.directory))
+        return os.path.join(self.cache_dir, 'nuclides-%s.npz' % key[:16])
+
+    def _load(self):
+        signature = self.signature()
+        self.loaded_signature = signature
+        if self.cache_dir is False:
+            return self._parse(signature)
+        path = self._cache_path()
+        try:
+            with np.load(path) as cache:
+                meta = json.loads(str(cache['meta']))
+                if meta['signature'] == signature:
+                    return _unpack(meta, cache['Ey'], cache['I'])
+        except (OSError, KeyError, ValueError):
+            pass
+        entries = self._parse(signature)
+        self._save(path, signature, entries)
+        return entries
+
+    def _parse(self,signature):
+        entries = {}
+        for name, size, mtime in signature:
+            entry = parse_lara(os.path.join(self.directory, name))
+            entries[entry['nuclide']] = entry
+        return entries
+
+    def _save(self,path,signature,entries):
+        meta, Ey, I = _pack(signature, entries)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), Ey=Ey, I=I)
+        os.replace(tmp, path)
+
+    def lookup(self,nuclides,daughters=False):
+        """
+
+        Description
+        -----------
+        Gamma lines of several nuclides at once.
+
+        Parameters
+        ----------
+        nuclides : list of LARA names, e.g. ['Se-75', 'Ba-137m']
+        daughters : True to add the gamma lines of the daughters that are in
+        the library (recursively), weighted by their branching fractions,
+        i.e. assuming secular equilibrium
+
+        Returns
+        -------
+        nuclide_data : list of collections of gamma energies [keV] and
+        intensities [0-1] as returned by read_lara(), with in addition the
+        half-life [s], the daughters and, per line, the emitting nuclide
+        (origin)
+
+        """
+        return [self._nuclide_data(nuclide, daughters) for nuclide in nuclides]
+
+    def _nuclide_data(self,nuclide,daughters):
+        if nuclide not in self.entries:
+            raise KeyError('%s: %s' % (nuclide, missing_message))
+        entry = self.entries[nuclide]
+        lines = self._lines(nuclide, 1., daughters, ())
+        nuclide_data = instance_of_data_collection()
+        nuclide_data.nuclide = entry['nuclide']
+        nuclide_data.element = entry['element']
+        nuclide_data.half_life = entry['half_life']
+        nuclide_data.daughters = [tuple(d) for d in entry['daughters']]
+        nuclide_data.Ey = np.concatenate([l[0] for l in lines])
+        nuclide_data.I = np.concatenate([l[1] for l in lines])
+        nuclide_data.origin = np.concatenate([np.full(len(l[0]), l[2], dtype=object) for l in lines])
+        return nuclide_data
+
+    def _lines(self,nuclide,weight,daughters,parents):
+        entry = self.entries[nuclide]
+        lines = [(np.asarray(entry['Ey'],dtype=np.float64),
+                  weight*np.asarray(entry['I'],dtype=np.float64), nuclide)]
+        if daughters:
+            for daughter, branching in entry['daughters']:
+                if daughter in self.entries and daughter not in parents:
+                    lines += self._lines(daughter, weight*branching, True, parents+(nuclide,))
+        return lines
+
+    def mixture(self,nuclides,fractions,daughters=False):
+        """
+
+        Description
+        -----------
+        Gamma lines of a mixture of nuclides, e.g. a multi-nuclide source
+        term, as a single collection: the intensities of every nuclide are
+        weighted by its fraction of the released activity, so that the gamma
+        factors of the mixture are computed in one go.
+
+        Parameters
+        ----------
+        nuclides : list of LARA names
+        fractions : fraction of the activity of every nuclide [-]
+        daughters : see lookup()
+
+        Returns
+        -------
+        nuclide_data : collection with Ey [keV], I [per decay of the
+        mixture] and origin of all lines
+
+        """
+        data = self.lookup(nuclides, daughters)
+        fractions = np.broadcast_to(np.asarray(fractions,dtype=np.float64), (len(data),))
+        nuclide_data = instance_of_data_collection()
+        nuclide_data.nuclide = list(nuclides)
+        nuclide_data.Ey = np.concatenate([d.Ey for d in data])
+        nuclide_data.I = np.concatenate([f*d.I for f, d in zip(fractions, data)])
+        nuclide_data.origin = np.concatenate([d.origin for d in data])
+        return nuclide_data
+
+def _pack(signature,entries):
+    meta = {'version': cache_version, 'signature': signature, 'nuclides': []}
+    offset = 0
+    for nuclide in sorted(entries):
+        entry = entries[nuclide]
+        n = len(entry['Ey'])
+        meta['nuclides'].append({'nuclide': nuclide, 'element': entry['element'],
+                                 'half_life': entry['half_life'],
+                                 'daughters': entry['daughters'],
+                                 'start': offset, 'stop': offset+n})
+        offset += n
+    Ey = np.array([e for nuclide in sorted(entries) for e in entries[nuclide]['Ey']], dtype=np.float64)
+    I = np.array([i for nuclide in sorted(entries) for i in entries[nuclide]['I']], dtype=np.float64)
+    return meta, Ey, I
+
+def _unpack(meta,Ey,I):
+    entries = {}
+    for m in meta['nuclides']:
+        entry = dict(m)
+        start, stop = entry.pop('start'), entry.pop('stop')
+        entry['Ey'], entry['I'] = Ey[start:stop], I[start:stop]
+        entries[m['nuclide']] = entry
+    return entries
+
+_default_library = None
+
+def default_library():
+    """
+    The library of data/nuclides, loaded once per process and reloaded when
+    the sheets change.
+    """
+    global _default_library
+    if _default_library is None or _default_library.signature() != _default_library.loaded_signature:
+        _default_library = nuclide_library()
+    return _default_library
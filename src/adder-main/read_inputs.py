@@ -5,9 +5,10 @@
 @author: jfrankem
 """
 
-import pandas as pd
 import numpy as np
-import os
+
+from meteo_store import mast_store
+from nuclide_library import default_library
 
 class data_collection(object):
     pass
@@ -26,6 +27,9 @@ def read_lara(nuclide):
     it into the data/nuclides folder. Right now, it only picks out the gammas.
     
     NB. Turn daughter nuclides off.
+    
+    The sheets are parsed once and cached, see nuclide_library.py, which
+    also provides batch lookups with daughters and multi-nuclide mixtures.
 
     Parameters
     ----------
@@ -41,60 +45,34 @@ def read_lara(nuclide):
     
     """
     
-    nuclide_data = instance_of_data_collection()
-    
-    absolute_path      = os.path.dirname(__file__)
-    relative_directory = 'data/nuclides'
-    directory = os.path.join(absolute_path,relative_directory)
-    filenames = os.listdir(directory)
-    filepaths = [os.path.join(directory, f) for f in filenames]
-    for i in range(len(filenames)):
-        if nuclide in filenames[i]:
-            if not(nuclide[len(nuclide)-1] != 'm' and filenames[i][len(nuclide)] == 'm'):
-                filepath = filepaths[i]            
-    try:
-        file = open(filepath)
-    except:
-        print('This nuclide is not yet included in data/nuclides. Go to '
-              'http://www.nucleide.org/Laraweb/index.php and download '
-              'the data and emissions file in ASCII text format, e.g.'
-              'Se-75.lara.txt. Put it in the folder and rerun.')
-    
-    linenum = -1
-    for line in file:
-        linenum += 1
-        if 'Nuclide' in line:
-            nuclide_data.nuclide = line[line.find(' ; ')+3:-1].strip()
-        elif 'Element' in line:
-            nuclide_data.element = line[line.find(' ; ')+3:-1].strip()
-        elif '----------' in line:
-            linenum_start = linenum
-    file.close()
-        
-    data = pd.read_csv(os.path.join(absolute_path,filepath),header=linenum_start+1,engine='python',sep=' ; ',index_col=False,usecols=range(5))
-    data.drop(data.tail(1).index,inplace=True)
-    data = data[data['Type']=='g']
+    data = default_library()[nuclide]
     
-    nuclide_data.Ey=np.squeeze(pd.DataFrame(data,columns = ['Energy (keV)']).to_numpy(dtype=np.float64))
-    nuclide_data.I=np.squeeze(pd.DataFrame(data,columns = ['Intensity (%)']).to_numpy())/100 # to fractions
+    nuclide_data = instance_of_data_collection()
+    nuclide_data.nuclide = data.nuclide
+    nuclide_data.element = data.element
+    nuclide_data.Ey = np.squeeze(data.Ey)
+    nuclide_data.I = np.squeeze(data.I)
     
     return nuclide_data
 
 def read_selenium_meteo(t0,t1):
-    meteo       = instance_of_data_collection()
-    abspath     = os.path.dirname(__file__)
-    relpath     = 'data/meteo/met20190515.txt'
-    data        = pd.read_csv(os.path.join(abspath,relpath),sep=';')
-    meteo.t     = pd.to_datetime(data['Date_Time'],format='%Y-%m-%d %H:%M:%S').to_numpy()
-    meteo_window = (meteo.t>=t0) == (meteo.t<=t1)
-    meteo.t     = pd.to_datetime(data['Date_Time'],format='%Y-%m-%d %H:%M:%S').to_numpy()[meteo_window]
-    meteo.T8    = np.squeeze(pd.DataFrame(data,columns = ['T8']).to_numpy())[meteo_window]
-    meteo.T114  = np.squeeze(pd.DataFrame(data,columns = ['T114']).to_numpy())[meteo_window]
-    meteo.Href  = 69
-    meteo.Ta    = meteo.T8 + (meteo.T114-meteo.T8)/(114-8)*(60-8)
-    meteo.U     = np.squeeze(pd.DataFrame(data,columns = ['Speed']).to_numpy())[meteo_window]
-    meteo.wd    = np.squeeze(pd.DataFrame(data,columns = ['Azimuth']).to_numpy())[meteo_window]
-    meteo.sig_wd= np.squeeze(pd.DataFrame(data,columns = ['AzimSigma']).to_numpy())[meteo_window]
-    meteo.E     = np.squeeze(pd.DataFrame(data,columns = ['E_dT']).to_numpy())[meteo_window]
-    meteo.T     = 10
-    return meteo
\ No newline at end of file
+    """
+    
+    Description
+    -----------
+    Meteo data of the mast CSV files in data/meteo (e.g. met20190515.txt)
+    between t0 and t1 (inclusive). The files are converted once into a
+    columnar store, and a window is then read by binary search in its time
+    index, see meteo_store.py.
+
+    Parameters
+    ----------
+    t0, t1 : first and last time of the window, e.g.
+    np.datetime64('2019-05-15 00:00')
+    
+    Returns
+    -------
+    meteo : collection of meteo data, see meteo_store.meteo_store.meteo()
+    
+    """
+    return mast_store().meteo(t0,t1)
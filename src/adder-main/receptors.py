@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Receptor mode: dose rate series at a few detectors without computing the
+full concentration fields. The plume is only evaluated on the cells within a
+radius of the detectors (their support), beyond which the attenuation and
+build-up of air leave a negligible kernel (see receptor_radius()), and the
+dose rates follow directly from those cells.
+
+Build-up keeps the kernel of air significant far beyond the mean free path
+(about 80 m at 260 keV): for the Se-75 lines, B*exp(-mu*r) drops to 1e-2 of
+its value at r=0 at 715 m and to 1e-3 at 950 m. Measured for the IMR/M03,
+M15 and M04 detectors with benchmarks.synthetic_meteo(), against
+multi_plume() plus dose_rate_series(), errors relative to the peak dose
+rate of a detector:
+    - default grid of benchmarks.py (101x101x21 cells over 1000x1000x200 m,
+      144 timesteps): tol=1e-3 keeps all cells (6% less run time, exact),
+      tol=1e-2 95% of the cells (13% less run time, errors up to 0.04%);
+    - large grid (201x201x41 cells over 2000x2000x400 m, 24 timesteps):
+      tol=1e-3 keeps 73% of the cells (23% less run time, errors up to
+      0.005%), tol=1e-2 45% (59% less run time, errors up to 0.1%).
+"""
+
+import numpy as np
+
+from gamma_dosimetry import cached_radial_kernel
+from gaussian_plume import gather, iter_plume_blocks
+from mathematical_tools import grid_shape, instance_of_data_collection
+
+def receptor_radius(nuclide_data,rho,database,tol=1e-3,r_max=2000.):
+    """
+    
+    Description
+    -----------
+    Distance beyond which the attenuation and build-up of the gamma lines,
+    
+        f(r) = sum_i I_i*prefac_i*B_i(mu_i*r)*exp(-mu_i*r)
+    
+    (see gamma_dosimetry.radial_kernel), stays below tol times f(0), for
+    H*(10) and D. f(r)*dr is the dose rate of a uniform spherical shell of
+    radius r and thickness dr, so tol bounds the contribution of the shells
+    beyond the radius relative to the nearest ones.
+
+    Parameters
+    ----------
+    nuclide_data : collection of gamma energies and intensities, see read_lara()
+    rho : Density of air [g/cm3]
+    database : build-up factor table, see buildup_factor()
+    tol : threshold relative to f(0) [-]
+    r_max : largest radius, returned if f does not drop below tol before [m]
+
+    Returns
+    -------
+    radius : [m]
+
+    """
+    kernel = cached_radial_kernel(nuclide_data,rho,database,r_max)
+    f = kernel.f/kernel.f[:,:1]
+    above = np.flatnonzero(np.any(f >= tol,axis=0) & (kernel.r <= r_max))
+    return float(min(r_max, kernel.r[min(above[-1]+1,len(kernel.r)-1)]))
+
+def receptor_support(grid,xq,yq,zq,nuclide_data,rho,database,tol=1e-3):
+    """
+    
+    Description
+    -----------
+    Support of each detector: the cells within receptor_radius() of it.
+
+    Parameters
+    ----------
+    see gamma_dosimetry.gamma_factors_many()
+    tol : see receptor_radius()
+
+    Returns
+    -------
+    supports : list with, per detector, the sorted flat indices of the cells
+    in the support
+
+    """
+    xq, yq, zq = [np.atleast_1d(np.asarray(v,dtype=np.float64)) for v in (xq,yq,zq)]
+    shape = grid_shape(grid)
+    # largest distance between a detector and a corner of the grid
+    corners = [np.array([np.min(v),np.max(v)]) for v in (grid.X,grid.Y,grid.Z)]
+    r_max = max(np.sqrt(np.max((corners[0]-xj)**2)+np.max((corners[1]-yj)**2)+np.max((corners[2]-zj)**2))
+                for xj, yj, zj in zip(xq,yq,zq))
+    radius = receptor_radius(nuclide_data,rho,database,tol,1.01*r_max)
+    supports = []
+    for xj, yj, zj in zip(xq,yq,zq):
+        r2 = np.broadcast_to((grid.X-xj)**2+(grid.Y-yj)**2+(grid.Z-zj)**2,shape)
+        supports.append(np.flatnonzero(r2 <= radius**2))
+    return supports
+
+def receptor_grid(grid,cells):
+    """
+    Returns a grid (data_collection) of which X, Y and Z are the 1D vectors
+    of the coordinates of the given flat cell indices of grid. The plume
+    functions accept it like a full grid.
+    """
+    sub = instance_of_data_collection()
+    sub.dx, sub.dy, sub.dz = grid.dx, grid.dy, grid.dz
+    shape = grid_shape(grid)
+    idx = np.unravel_index(cells,shape)
+    sub.X = gather(grid.X,idx,shape)
+    sub.Y = gather(grid.Y,idx,shape)
+    sub.Z = gather(grid.Z,idx,shape)
+    sub.cells = cells
+    return sub
+
+def receptor_dose_rates(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,supports,L=1e20,**kwargs):
+    """
+    
+    Description
+    -----------
+    Dose rate series at the detectors of gf_H10 and gf_D, as
+    gamma_dosimetry.dose_rate_series() would give for the output of
+    multi_plume(), but evaluating the plume only on the union of the supports
+    of the detectors (see receptor_support()).
+
+    Parameters
+    ----------
+    see multi_plume() for grid, meteo, source, Umin, switch_plume_type,
+    switch_plume_rise and L
+    gf_H10 : H*(10) gamma factors, shape (n_detectors, Ny, Nx, Nz)
+    gf_D : Air kerma gamma factors, same shape as gf_H10
+    supports : supports of the detectors, see receptor_support()
+    kwargs : block_size, workers, executor, see multi_plume()
+
+    Returns
+    -------
+    H10 : Ambient dose equivalent rate, shape (n_detectors, Nt) [nSv/h]
+    D : Gamma dose rate to air, shape (n_detectors, Nt) [nGy/h]
+    cells : flat indices of the cells on which the plume was evaluated
+
+    """
+    Ncells = np.prod(np.shape(gf_H10)[-3:])
+    union = np.zeros(Ncells,dtype=bool)
+    for support in supports:
+        union[support] = True
+    cells = np.flatnonzero(union)
+    sub = receptor_grid(grid,cells)
+    G = np.concatenate([np.reshape(gf_H10,(-1,Ncells))[:,cells], np.reshape(gf_D,(-1,Ncells))[:,cells]])
+    HD = np.zeros((G.shape[0],len(meteo.wd)))
+    for i0, i1, cb in iter_plume_blocks(sub,meteo,source,Umin,switch_plume_type,switch_plume_rise,L,**kwargs):
+        HD[:,i0:i1] = G @ cb
+    n = G.shape[0]//2
+    return HD[:n], HD[n:], cells
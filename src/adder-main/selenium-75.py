@@ -5,7 +5,7 @@
 import matplotlib.dates as mdates 
 
 from gaussian_plume import multi_plume
-from gamma_dosimetry import time_resolved_H10
+from gamma_dosimetry import time_resolved_H10_many
 from mathematical_tools import create_square_centered_grid
 from read_inputs import instance_of_data_collection, read_selenium_meteo ,read_lara
 
@@ -76,10 +76,8 @@
 
 # Calculate concentration fields in time via a Gaussian plume model
 c, TIC = multi_plume(grid, meteo, source, Umin, switch_plume_type, switch_plume_rise)
-# Calculate the dose rate in time for each detector
-H10 = np.zeros([len(xq),len(source.Q)])
-for i in range(len(xq)):
-    H10[i,:]=time_resolved_H10(grid,xq[i],yq[i],zq[i],c,nuclide_data,rho,database)[0]
+# Calculate the dose rate in time for all detectors at once
+H10 = time_resolved_H10_many(grid,xq,yq,zq,c,nuclide_data,rho,database)[0]
 
 """
 3. Visualisation
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Output buffers that can be filled by several worker processes without copies,
+e.g. the concentration array c of gaussian_plume.multi_plume() when it runs on
+a process pool, or gamma factors and dose rates shared by ensemble members.
+
+Two kinds of buffers are supported:
+    - shared_buffer, an array in a multiprocessing.shared_memory block;
+    - np.memmap, an array in a file on disk.
+Both are passed to workers as small handles (see worker_handle()) by which
+the workers attach to the same memory, instead of pickling the data.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+class shared_buffer(object):
+    """
+    
+    Description
+    -----------
+    Array in a shared memory block. Pickling a shared_buffer only sends the
+    name of the block, and unpickling attaches to it, so it can be passed to
+    other processes. The process that created it should call unlink() once
+    the buffer is no longer needed (or use it as a context manager); every
+    process should call close().
+
+    Parameters
+    ----------
+    shape : shape of the array
+    dtype : data type of the array
+    name : name of an existing block to attach to, None to create one
+
+    Attributes
+    ----------
+    array : the numpy array backed by the shared memory block
+
+    """
+    def __init__(self,shape,dtype=np.float64,name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if name is None:
+            nbytes = max(1,int(np.prod(self.shape))*self.dtype.itemsize)
+            self.shm = shared_memory.SharedMemory(create=True,size=nbytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.array = np.ndarray(self.shape,dtype=self.dtype,buffer=self.shm.buf)
+    
+    @property
+    def name(self):
+        return self.shm.name
+    
+    def __getstate__(self):
+        return (self.shape,self.dtype.str,self.shm.name)
+    
+    def __setstate__(self,state):
+        shape, dtype, name = state
+        self.__init__(shape,dtype,name)
+    
+    def close(self):
+        self.array = None
+        self.shm.close()
+    
+    def unlink(self):
+        self.close()
+        if self.owner:
+            self.shm.unlink()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exc):
+        self.unlink()
+
+def as_array(buffer):
+    """Returns the numpy array of a shared_buffer, np.memmap or np.ndarray."""
+    if isinstance(buffer,shared_buffer):
+        return buffer.array
+    return buffer
+
+def worker_handle(buffer):
+    """
+    
+    Description
+    -----------
+    Returns a small picklable handle by which a worker process can attach to
+    the memory of buffer with attach(), or None if buffer is a plain array
+    that cannot be shared (workers then have to return their results).
+
+    """
+    if isinstance(buffer,shared_buffer):
+        return buffer
+    # views of a memmap inherit the offset of their parent, so only whole
+    # memmaps can be reopened by the workers
+    if (isinstance(buffer,np.memmap) and buffer.filename is not None
+            and not isinstance(buffer.base,np.memmap)
+            and buffer.flags.c_contiguous):
+        return ('memmap',buffer.filename,buffer.dtype.str,buffer.shape,buffer.offset)
+    return None
+
+def attach(handle):
+    """Returns the array of a handle from worker_handle(), or None."""
+    if handle is None:
+        return None
+    if isinstance(handle,shared_buffer):
+        return handle.array
+    kind, filename, dtype, shape, offset = handle
+    return np.memmap(filename,dtype=dtype,mode='r+',shape=shape,offset=offset)
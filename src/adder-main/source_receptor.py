@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Source-receptor matrices and source-term inversion.
+
+The concentration field of timestep i of multi_plume() is proportional to
+source.Q[i] (and only depends on the release of that timestep), and the dose
+rates are linear in the concentrations. The dose rates at the detectors are
+therefore
+
+    H10[j,i] = M_H10[j,i]*Q[i],    D[j,i] = M_D[j,i]*Q[i],
+
+where M is the dose rate of a unit release (1 Bq/s) in timestep i at
+detector j. M is computed with a single plume run for a unit release and
+cached per grid, meteo, source, plume options and detectors, so that trying
+source terms, or fitting one to TELERAD observations such as H10T (see
+invert_source_term()), is a small linear computation instead of many plume
+runs.
+
+Typical use:
+    M_H10, M_D = cached_source_receptor_matrix(grid,meteo,source,Umin,
+        switch_plume_type,switch_plume_rise,gf_H10,gf_D)
+    fit = invert_source_term(M_H10,H10T,sig2H10T)
+    H10 = dose_rates(M_H10,fit.Q)
+"""
+
+import copy
+
+import numpy as np
+
+import kernel_cache
+from gamma_dosimetry import dose_rate_accumulator
+from gaussian_plume import inversion_heights, stream_plume
+from mathematical_tools import bounded_least_squares, instance_of_data_collection
+
+def unit_source(source,Nt):
+    """Copy of source releasing 1 Bq/s in each of the Nt timesteps."""
+    source_u = copy.copy(source)
+    source_u.Q = np.ones(Nt)
+    return source_u
+
+def source_receptor_matrix(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,L=1e20,**kwargs):
+    """
+
+    Description
+    -----------
+    Dose rates at the detectors of gf_H10 and gf_D of a unit release in every
+    timestep, from one streamed plume run (see stream_plume()). source.Q is
+    not used.
+
+    Parameters
+    ----------
+    see multi_plume() for grid, meteo, source, Umin, switch_plume_type,
+    switch_plume_rise and L
+    gf_H10 : H*(10) gamma factors, shape (n_detectors, Ny, Nx, Nz)
+    gf_D : Air kerma gamma factors, same shape as gf_H10
+    kwargs : block_size, workers, executor, nsig, dtype, cache, passed to
+    stream_plume()
+
+    Returns
+    -------
+    M_H10 : Ambient dose equivalent rate of a unit release, shape
+    (n_detectors, Nt) [(nSv/h)/(Bq/s)]
+    M_D : Gamma dose rate to air of a unit release [(nGy/h)/(Bq/s)]
+
+    """
+    Nt = len(meteo.wd)
+    gf_H10 = np.reshape(gf_H10,(-1,)+np.shape(gf_H10)[-3:])
+    gf_D = np.reshape(gf_D,(-1,)+np.shape(gf_D)[-3:])
+    acc = dose_rate_accumulator(gf_H10,gf_D,Nt)
+    stream_plume(grid,meteo,unit_source(source,Nt),Umin,switch_plume_type,switch_plume_rise,[acc],L,**kwargs)
+    return acc.H10, acc.D
+
+def cached_source_receptor_matrix(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,L=1e20,cache_dir=None,max_size=kernel_cache.default_max_size,**kwargs):
+    """
+
+    Description
+    -----------
+    Same as source_receptor_matrix(), but the result is stored in the on-disk
+    kernel cache (see kernel_cache.py), keyed by a hash of the grid axes, the
+    meteo data, the stack parameters, the plume options, the bin widths of a
+    plume_cache and the gamma factors (see source_receptor_key()).
+
+    Parameters
+    ----------
+    see source_receptor_matrix()
+    cache_dir : cache directory, kernel_cache.default_cache_dir if None
+    max_size : maximum total size of the cache [bytes]
+
+    Returns
+    -------
+    M_H10, M_D : see source_receptor_matrix() (read-only)
+
+    """
+    key = source_receptor_key(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,L,**kwargs)
+    M = kernel_cache.load_kernel(key,cache_dir,mmap_mode=None)
+    if M is None:
+        M = np.stack(source_receptor_matrix(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,L,**kwargs))
+        kernel_cache.save_kernel(key,M,cache_dir,max_size)
+    M.setflags(write=False)
+    return M[0], M[1]
+
+def source_receptor_key(grid,meteo,source,Umin,switch_plume_type,switch_plume_rise,gf_H10,gf_D,L=1e20,nsig=8,dtype=np.float64,cache=None,**kwargs):
+    """
+    Key of a source-receptor matrix in the kernel cache. Only the inputs of
+    the plume (see plume_inputs()), the bin widths of the plume_cache, which
+    change the result by the quantization error, and the gamma factors are
+    hashed; the execution options in kwargs do not change the result.
+    """
+    bins = None if cache is None else (float(cache.wd_step), float(cache.U_step), float(cache.dT_step))
+    axes = (np.ravel(grid.X[0,:,0]), np.ravel(grid.Y[:,0,0]), np.ravel(grid.Z[0,0,:]))
+    fields = [np.asarray(getattr(meteo,name),dtype=np.float64) for name in ['wd','U','E','Ta']]
+    stack = [float(getattr(source,name)) for name in ['Hs','Ts','Vs']]
+    return kernel_cache.kernel_key('source_receptor', 2, axes, fields,
+                                   float(meteo.Href), float(meteo.T), stack,
+                                   float(Umin), switch_plume_type, switch_plume_rise,
+                                   inversion_heights(L,len(meteo.wd)),
+                                   nsig, np.dtype(dtype).name, bins,
+                                   np.asarray(gf_H10), np.asarray(gf_D))
+
+def dose_rates(M,Q):
+    """
+    Dose rates at the detectors, shape (n_detectors, Nt), for the release
+    rates Q [Bq/s] of the Nt timesteps and a source-receptor matrix M (see
+    source_receptor_matrix()).
+    """
+    return np.asarray(M)*np.asarray(Q)
+
+def invert_source_term(M,obs,sig,basis=None,lower=0.,upper=np.inf):
+    """
+
+    Description
+    -----------
+    Weighted least-squares fit of the source term to dose rate observations,
+    within bounds (non-negative by default):
+
+        min sum_j,i ((M[j,i]*Q[i] - obs[j,i])/sig[j,i])**2,   Q = basis @ p,
+        lower <= p <= upper
+
+    Observations that are NaN are left out. Without a basis, every timestep
+    has its own release rate; timesteps that none of the detectors sees keep
+    their lower bound (see resolved).
+
+    Parameters
+    ----------
+    M : source-receptor matrix, shape (n_detectors, Nt), see
+    source_receptor_matrix() [(nSv/h)/(Bq/s)]
+    obs : observed dose rates with background subtracted, e.g. H10T, shape
+    (n_detectors, Nt) [nSv/h]
+    sig : uncertainty of the observations, e.g. sig2H10T, either one per
+    detector or broadcast against obs; only the relative weights 1/sig**2
+    affect the solution [nSv/h]
+    basis : release profiles, shape (Nt, n_parameters), e.g. a column of
+    ones for a constant release rate; the identity if None
+    lower, upper : bounds of the parameters [Bq/s]
+
+    Returns
+    -------
+    fit : data_collection with
+        p : fitted parameters [Bq/s]
+        Q : fitted release rate of every timestep [Bq/s]
+        obs_fit : dose rates of the fitted source term, shape
+        (n_detectors, Nt)
+        residuals : (obs - obs_fit)/sig, NaN where obs is NaN [-]
+        chi2 : sum of the squared residuals [-]
+        at_bound : whether each parameter is at one of its bounds
+        resolved : whether each parameter affects any observation
+        p_std : standard deviation of the parameters that are not at a bound,
+        from the weights 1/sig**2 (NaN at a bound) [Bq/s]
+        status, converged : convergence status of the bounded solver, see
+        bounded_least_squares()
+
+    """
+    M = np.atleast_2d(np.asarray(M,dtype=np.float64))
+    obs = np.reshape(np.asarray(obs,dtype=np.float64),M.shape)
+    sig = np.asarray(sig,dtype=np.float64)
+    if sig.ndim == 1 and len(sig) == M.shape[0]:
+        # one uncertainty per detector
+        sig = sig[:,None]
+    sig = np.broadcast_to(sig,M.shape)
+    Nt = M.shape[-1]
+    if basis is None:
+        basis = np.eye(Nt)
+    basis = np.reshape(np.asarray(basis,dtype=np.float64),(Nt,-1))
+
+    # rows of the weighted system, one per valid observation
+    valid = np.isfinite(obs)
+    w = 1/sig
+    A = (w*M)[...,None]*basis # (n_detectors, Nt, n_parameters)
+    A, b = A[valid], (w*obs)[valid]
+    p, free, status = bounded_least_squares(A,b,lower,upper)
+
+    fit = instance_of_data_collection()
+    fit.p = p
+    fit.Q = basis @ p
+    fit.obs_fit = dose_rates(M,fit.Q)
+    fit.residuals = np.where(valid,(obs-fit.obs_fit)*w,np.nan)
+    fit.chi2 = float(np.nansum(fit.residuals**2))
+    fit.at_bound = ~free
+    fit.status = status
+    fit.converged = status > 0
+    fit.resolved = np.any(A != 0,axis=0)
+    fit.p_std = np.full(len(p),np.nan)
+    if free.any():
+        cov = np.linalg.pinv(A[:,free].T @ A[:,free])
+        fit.p_std[free] = np.sqrt(np.diag(cov))
+    return fit
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+The ADDER modules are plain scripts that import each other by module name, so
+the parent directory is put on the path for the tests.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mathematical_tools import create_square_centered_grid, instance_of_data_collection  # noqa: E402
+
+
+@pytest.fixture
+def grid():
+    return create_square_centered_grid(500, 500, 200, 21, 21, 6)
+
+
+@pytest.fixture
+def meteo():
+    meteo = instance_of_data_collection()
+    meteo.wd = np.array([60., 75., 110., 250., 355., 5.])
+    meteo.U = np.array([2.1, 3.5, 0.3, 6.0, 4.2, 12.])
+    meteo.E = np.array([1, 2, 3, 4, 5, 6])
+    meteo.Ta = np.array([14., 16., 13., 20., 9., 12.])
+    meteo.Href = 69
+    meteo.T = 10
+    return meteo
+
+
+@pytest.fixture
+def source():
+    source = instance_of_data_collection()
+    source.Hs = 60
+    source.Ts = 15
+    source.Vs = 150000/3600
+    source.Q = np.array([8.3, 8.3, 8.3, 0., 1., 2.])*1e6
+    return source
+
+
+@pytest.fixture
+def nuclide_data():
+    nuclide_data = instance_of_data_collection()
+    nuclide_data.Ey = np.array([264.6576, 136.0001, 279.5422, 66.0518])
+    nuclide_data.I = np.array([0.5875, 0.577, 0.2489, 0.01085])
+    return nuclide_data
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+import kernel_cache
+import nuclide_library
+from benchmarks import case_id, compare, run
+
+
+def test_benchmarks_small():
+    directory = kernel_cache.default_cache_dir
+    results = run(sizes=['small'], lengths=['short'], repeat=1, days=2)
+    # the synthetic inputs do not leak into the defaults
+    assert kernel_cache.default_cache_dir == directory
+    assert nuclide_library.default_directory.endswith('nuclides')
+    names = {r['name'] for r in results['cases']}
+    assert names == {'single_plume', 'buildup_factor', 'gamma_factors', 'multi_plume',
+                     'time_resolved_H10', 'read_lara', 'parse_lara_sheets',
+                     'read_selenium_meteo'}
+    for r in results['cases']:
+        assert r['time'] > 0 and r['peak_memory'] > 0
+
+    assert compare(results, results) == []
+    slower = copy.deepcopy(results)
+    slower['cases'][0]['time'] *= 2
+    slower['cases'][1]['peak_memory'] *= 2
+    regressions = compare(slower, results)
+    assert len(regressions) == 2
+    assert regressions[0].startswith(case_id(results['cases'][0]))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from concentration_store import concentration_store, store_plume
+from gamma_dosimetry import dose_rate_series, gamma_factors_many
+from gaussian_plume import multi_plume
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+def test_store_plume(tmp_path, grid, meteo, source, nuclide_data):
+    meteo.t = np.arange('2019-05-15T15:20', '2019-05-15T16:20', 10,
+                        dtype='datetime64[m]')
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    store_plume(str(tmp_path/'run'), grid, meteo, source, 0.5, 'inversion', 'hx')
+
+    store = concentration_store.open(str(tmp_path/'run'))
+    assert store.complete
+    np.testing.assert_array_equal(np.moveaxis(store.c, 0, -1), c)
+    np.testing.assert_array_equal(store.TIC(), TIC)
+    np.testing.assert_array_equal(store.grid().X, grid.X)
+    np.testing.assert_array_equal(store.meteo().wd, meteo.wd)
+    assert store.meteo().t[0] == meteo.t[0]
+
+    gf_H10, gf_D = gamma_factors_many(grid, [-157.2, -262.2], [-142.8, -121.6],
+                                      [1.0, 1.0], nuclide_data, 0.001161, 'nucl')
+    H10, D = store.dose_rates(gf_H10, gf_D, block_size=4)
+    H10_ref, D_ref = dose_rate_series(gf_H10, gf_D, c)
+    np.testing.assert_allclose(H10, H10_ref, rtol=1e-12)
+    np.testing.assert_allclose(D, D_ref, rtol=1e-12)
+
+    # a single detector
+    H10_1, D_1 = store.dose_rates(gf_H10[0], gf_D[0], block_size=4)
+    np.testing.assert_allclose(H10_1, H10_ref[0], rtol=1e-12)
+
+
+def test_store_plume_dtype(tmp_path, grid, meteo, source):
+    # the fields are computed in the stored dtype, not cast from float64
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                         dtype=np.float32)
+    store = store_plume(str(tmp_path/'run'), grid, meteo, source, 0.5,
+                        'inversion', 'hx', dtype=np.float32)
+    assert store.c.dtype == np.float32
+    np.testing.assert_array_equal(np.moveaxis(store.c, 0, -1), c)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from dose_maps import dose_map, dose_maps
+from gamma_dosimetry import dose_rate_series, gamma_factors_many
+from gaussian_plume import multi_plume, stream_plume
+from mathematical_tools import create_square_centered_grid
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+@pytest.mark.parametrize("zq", [0., 1.])
+def test_dose_maps(meteo, source, nuclide_data, zq):
+    grid = create_square_centered_grid(500, 400, 200, 21, 17, 6)
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    H10, D = dose_maps(grid, c, nuclide_data, 0.001161, 'nucl', zq)
+    assert H10.shape == D.shape == (len(meteo.wd), 17, 21)
+
+    cells = [(0, 0), (3, 7), (8, 10), (16, 20)]
+    xq = [grid.X[0, j, 0] for i, j in cells]
+    yq = [grid.Y[i, 0, 0] for i, j in cells]
+    gf_H10, gf_D = gamma_factors_many(grid, xq, yq, [zq]*len(cells),
+                                      nuclide_data, 0.001161, 'nucl')
+    H10q, Dq = dose_rate_series(gf_H10, gf_D, c)
+    for n, (i, j) in enumerate(cells):
+        np.testing.assert_allclose(H10[:, i, j], H10q[n], rtol=0, atol=1e-12*H10.max())
+        np.testing.assert_allclose(D[:, i, j], Dq[n], rtol=0, atol=1e-12*D.max())
+
+    engine = dose_map(grid, nuclide_data, 0.001161, 'nucl', zq, Nt=len(meteo.wd))
+    stream_plume(grid, meteo, source, 0.5, 'inversion', 'hx', [engine])
+    np.testing.assert_allclose(engine.H10, H10, rtol=0, atol=1e-12*H10.max())
+
+
+def test_dose_map_uniform_grid(grid, nuclide_data):
+    grid.dx = 2*grid.dx
+    with pytest.raises(ValueError):
+        dose_map(grid, nuclide_data, 0.001161, 'nucl')
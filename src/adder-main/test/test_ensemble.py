@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from ensemble import (multiplicative_lognormal, run_ensemble, stability_shift,
+                      wind_direction_from_sigma)
+from gamma_dosimetry import dose_rate_series, gamma_factors_many
+from gaussian_plume import multi_plume
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+@pytest.fixture
+def factors(grid, nuclide_data):
+    return gamma_factors_many(grid, [-157.2, -262.2, 200.0], [-142.8, -121.6, 150.0],
+                              [1.0, 1.0, 1.0], nuclide_data, 0.001161, 'nucl')
+
+
+def test_ensemble_without_perturbations(grid, meteo, source, factors):
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    H10, D = dose_rate_series(*factors, c)
+    ens = run_ensemble(grid, meteo, source, 0.5, 'inversion', 'hx', *factors,
+                       N=2, perturbations={}, members_per_batch=2, block_size=3,
+                       TIC=True)
+    np.testing.assert_allclose(ens.H10_mean, H10, rtol=1e-12)
+    np.testing.assert_allclose(ens.D[1], D, rtol=1e-12)
+    np.testing.assert_allclose(ens.TIC, TIC, rtol=1e-12)
+
+
+def test_ensemble_batches(grid, meteo, source, factors):
+    meteo.sig_wd = np.full(len(meteo.wd), 10.)
+    perturbations = {'wd': wind_direction_from_sigma(),
+                     'U': multiplicative_lognormal(0.2),
+                     'E': stability_shift(0.2, 0.2),
+                     'Q': multiplicative_lognormal(0.5)}
+    args = (grid, meteo, source, 0.5, 'inversion', 'hx', *factors)
+    ens1 = run_ensemble(*args, N=5, perturbations=perturbations, seed=1)
+    ens3 = run_ensemble(*args, N=5, perturbations=perturbations, seed=1,
+                        members_per_batch=3, block_size=4)
+    assert ens1.H10.shape == (5, 3, len(meteo.wd))
+    np.testing.assert_allclose(ens3.H10, ens1.H10, rtol=1e-12)
+    np.testing.assert_array_equal(ens3.samples['wd'], ens1.samples['wd'])
+    assert np.all((ens1.samples['E'] >= 1) & (ens1.samples['E'] <= 6))
+    assert ens1.H10_percentiles.shape == (3, 3, len(meteo.wd))
+    assert np.all(ens1.H10_std[:, source.Q > 0] > 0)
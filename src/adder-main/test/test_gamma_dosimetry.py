@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import gamma_dosimetry
+import kernel_cache
+
+from gamma_dosimetry import (Gy_to_H10, attenuation, buildup_factor, buildup_tables, cached_gamma_factors,
+                             dose_rate_series, gamma_factors, gamma_factors_many,
+                             lookup_table, radial_gamma_factors, radial_kernel,
+                             register_buildup_table)
+from mathematical_tools import create_square_centered_grid, find_nearest
+
+
+def buildup_factor_loop(Ey,mux,database):
+    # Reference implementation: the original cell-by-cell loop
+    Ba, Eya, muxa = buildup_tables(database)
+    iEy = find_nearest(Eya,Ey)
+    B = 0*mux
+    for i in range(mux.shape[0]):
+        for j in range(mux.shape[1]):
+            for k in range(mux.shape[2]):
+                imux= find_nearest(muxa, mux[i,j,k])
+                B0 = Ba[imux[0],iEy[0]] + (Ba[imux[0],iEy[1]]-Ba[imux[0],iEy[0]]) / (Eya[iEy[1]]-Eya[iEy[0]]) * (Ey-Eya[iEy[0]])
+                B1 = Ba[imux[1],iEy[0]] + (Ba[imux[1],iEy[1]]-Ba[imux[1],iEy[0]]) / (Eya[iEy[1]]-Eya[iEy[0]]) * (Ey-Eya[iEy[0]])
+                B[i,j,k]  = B0+(B1-B0)/(muxa[imux[1]]-muxa[imux[0]])*(mux[i,j,k]-muxa[imux[0]])
+    return B
+
+
+@pytest.mark.parametrize("database", ["martin", "nucl"])
+@pytest.mark.parametrize("Ey", [66.0518, 136.0001, 264.6576, 1173.0, 12000.0])
+def test_buildup_factor_matches_loop(database, Ey):
+    rng = np.random.default_rng(0)
+    mux = rng.uniform(0, 50, size=(7, 6, 5))
+    # tabulated values, midpoints and values past the end of the tables
+    mux[0, 0, :] = [0.0, 0.25, 1.0, 1.1, 40.0]
+    mux[1, 0, :] = [30.0, 35.0, 45.0, 60.0, 7.5]
+    B = buildup_factor(Ey, mux, database, chunk_size=17)
+    np.testing.assert_array_equal(B, buildup_factor_loop(Ey, mux, database))
+
+
+def test_table_registry():
+    assert lookup_table('nucl') is lookup_table('nucl_ANS')
+    assert lookup_table('H10') is lookup_table('H10')
+    register_buildup_table('test', [[1, 1], [2, 3]], [100, 200], [0, 1])
+    np.testing.assert_allclose(buildup_factor(150, np.array([0.5, 2.0]), 'test'),
+                               [1.75, 4.0])
+    with pytest.raises(ValueError):
+        register_buildup_table('test', [[1, 1]], [100, 200], [0, 1])
+
+
+def gamma_factors_loop(grid,xq,yq,zq,nuclide_data,rho,database):
+    # Reference implementation: the original per-line kernel of gamma_factors()
+    gf_D = np.zeros(grid.X.shape)
+    gf_H10 = np.zeros(grid.X.shape)
+    for i in range(nuclide_data.Ey.shape[0]):
+        mu, mu_en = attenuation(nuclide_data.Ey[i],rho)
+        prefac = 1/100*0.0364*(1293/(rho*1e6))*mu_en*nuclide_data.Ey[i]*1e-3
+        q = grid.dx*grid.dy*grid.dz/3.7e10
+        mux = mu*np.sqrt((grid.X-xq)**2+(grid.Y-yq)**2+(grid.Z-zq)**2)
+        B = buildup_factor_loop(nuclide_data.Ey[i],mux,database)
+        mux[mux==0] = np.inf
+        Dr = prefac*q*B*np.exp(-mux)/(mux/mu)**2*1e9*3600
+        Dr[grid.Z==0] = Dr[grid.Z==0]/2
+        Di = nuclide_data.I[i]*Dr
+        gf_D = gf_D + Di
+        gf_H10 = gf_H10 + Gy_to_H10(Di,nuclide_data.Ey[i])
+    return gf_H10, gf_D
+
+
+def test_gamma_factors_many(grid, nuclide_data):
+    xq = np.array([-157.2, 0.0, -305.8])
+    yq = np.array([-142.8, 0.0, 44.9])
+    zq = np.array([1.0, 0.0, 0.0])
+    # a tiny memory budget forces one detector per chunk
+    gf_H10, gf_D = gamma_factors_many(grid, xq, yq, zq, nuclide_data, 0.001161,
+                                      'nucl', max_memory=1)
+    assert gf_H10.shape == (3,) + grid.X.shape
+    for i in range(3):
+        H10i, Di = gamma_factors_loop(grid, xq[i], yq[i], zq[i], nuclide_data,
+                                      0.001161, 'nucl')
+        np.testing.assert_allclose(gf_H10[i], H10i, rtol=1e-12)
+        np.testing.assert_allclose(gf_D[i], Di, rtol=1e-12)
+        H10i, Di = gamma_factors(grid, xq[i], yq[i], zq[i], nuclide_data, 0.001161, 'nucl')
+        np.testing.assert_array_equal(gf_H10[i], H10i)
+
+
+def test_cached_gamma_factors(tmp_path, grid, nuclide_data):
+    args = (grid, -157.2, -142.8, 1.0, nuclide_data, 0.001161, 'nucl')
+    gf_H10, gf_D = cached_gamma_factors(*args, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+    H10c, Dc = cached_gamma_factors(*args, cache_dir=str(tmp_path))
+    assert isinstance(H10c, np.memmap)
+    np.testing.assert_array_equal(H10c, gamma_factors(*args)[0])
+    np.testing.assert_array_equal(Dc, gf_D)
+    # a new detector position is a new entry, the oldest one is evicted
+    cached_gamma_factors(grid, 0.0, -142.8, 1.0, nuclide_data, 0.001161, 'nucl',
+                         cache_dir=str(tmp_path), max_size=1)
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+
+
+def test_cached_gamma_factors_read_only(tmp_path, monkeypatch, grid, nuclide_data):
+    args = (grid, -157.2, -142.8, 1.0, nuclide_data, 0.001161, 'nucl')
+    gf_H10, gf_D = cached_gamma_factors(*args, cache_dir=str(tmp_path))
+
+    # a cache on a read-only file system cannot update the access times
+    def utime(path, *args, **kwargs):
+        raise PermissionError(13, 'Read-only file system', path)
+    monkeypatch.setattr(kernel_cache.os, 'utime', utime)
+    H10c, Dc = cached_gamma_factors(*args, cache_dir=str(tmp_path))
+    assert isinstance(H10c, np.memmap)
+    np.testing.assert_array_equal(H10c, gf_H10)
+
+
+@pytest.mark.parametrize("chunk_size", [None, 100])
+def test_dose_rate_series(chunk_size):
+    rng = np.random.default_rng(1)
+    gf_H10 = rng.uniform(size=(3, 5, 4, 6))
+    gf_D = rng.uniform(size=(3, 5, 4, 6))
+    c = rng.uniform(size=(5, 4, 6, 7))
+    H10, D = dose_rate_series(gf_H10, gf_D, c, chunk_size)
+    assert H10.shape == (3, 7)
+    for j in range(3):
+        for n in range(7):
+            assert H10[j, n] == pytest.approx(np.sum(c[:, :, :, n]*gf_H10[j]))
+            assert D[j, n] == pytest.approx(np.sum(c[:, :, :, n]*gf_D[j]))
+    H10_0, D_0 = dose_rate_series(gf_H10[0], gf_D[0], c, chunk_size)
+    np.testing.assert_allclose(H10_0, H10[0])
+
+
+@pytest.mark.parametrize("layout", ['float32', 'strided'])
+def test_dose_rate_series_blocks(monkeypatch, layout):
+    rng = np.random.default_rng(2)
+    gf_H10 = rng.uniform(size=(2, 30, 20, 10))
+    gf_D = rng.uniform(size=(2, 30, 20, 10))
+    c = rng.uniform(size=(30, 20, 10, 16))
+    if layout == 'float32':
+        c = c.astype(np.float32)
+    else:
+        c = c[..., ::2]
+    H10_ref = np.einsum('jyxz,yxzn->jn', gf_H10, c.astype(np.float64))
+    # blocks of a few hundred cells, far less than c
+    monkeypatch.setattr(gamma_dosimetry, 'chunk_bytes', 8*c.shape[-1]*500)
+    tracemalloc.start()
+    H10, D = dose_rate_series(gf_H10, gf_D, c)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    np.testing.assert_allclose(H10, H10_ref, rtol=1e-6 if layout == 'float32' else 1e-12)
+    # the stacked factors plus small blocks, no float64 copy of c
+    assert peak < 32*6000 + c.size*8/2
+
+
+def test_gamma_factors_compact_grid(grid, nuclide_data):
+    sparse = create_square_centered_grid(500, 500, 200, 21, 21, 6, sparse=True)
+    xq, yq, zq = np.array([-157.2, 44.9]), np.array([-142.8, 0.]), np.array([1., 0.])
+    gf = gamma_factors_many(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl')
+    gfs = gamma_factors_many(sparse, xq, yq, zq, nuclide_data, 0.001161, 'nucl')
+    np.testing.assert_array_equal(gfs[0], gf[0])
+    np.testing.assert_array_equal(gfs[1], gf[1])
+
+
+def test_radial_gamma_factors(grid, nuclide_data):
+    # detectors on a cell, on the ground and between cells
+    xq, yq, zq = np.array([0., 44.9, -157.2]), np.array([0., 0., -142.8]), np.array([0., 0., 1.])
+    gf = gamma_factors_many(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl')
+    gfr = radial_gamma_factors(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl', tol=1e-6)
+    for a, b in zip(gf, gfr):
+        np.testing.assert_array_equal(a == 0, b == 0)
+        np.testing.assert_allclose(b, a, rtol=2e-6)
+
+
+def test_radial_kernel_range(nuclide_data):
+    kernel = radial_kernel(nuclide_data, 0.001161, 'nucl', 100.)
+    assert kernel.error <= 1e-6
+    with pytest.raises(ValueError):
+        kernel(np.array([150.]))
+
+
+def test_radial_gamma_factors_float32(grid, nuclide_data):
+    xq, yq, zq = np.array([0., 44.9, -157.2]), np.array([0., 0., -142.8]), np.array([0., 0., 1.])
+    gf = radial_gamma_factors(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl')
+    out = (np.zeros_like(gf[0], dtype=np.float32), np.zeros_like(gf[1], dtype=np.float32))
+    gf32 = radial_gamma_factors(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl', out=out)
+    for a, b in zip(gf, gf32):
+        assert b.dtype == np.float32
+        np.testing.assert_allclose(b, a, rtol=1e-5)
+    # the kernel is evaluated in the type of the distances
+    kernel = radial_kernel(nuclide_data, 0.001161, 'nucl', 100.)
+    assert kernel(np.linspace(0, 100, 11, dtype=np.float32))[0].dtype == np.float32
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from ensemble import perturb_member, wind_direction_from_sigma
+from gaussian_plume import (culling_report, dispersion_BM, iter_plume,
+                            multi_plume, plume_cache, quantization_error,
+                            reflection_series, single_plume, stream_plume,
+                            tic_accumulator)
+from mathematical_tools import create_square_centered_grid
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+def test_stream_plume(grid, meteo, source):
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    for i, ci in iter_plume(grid, meteo, source, 0.5, 'inversion', 'hx'):
+        np.testing.assert_array_equal(ci, c[:, :, :, i])
+    tic = tic_accumulator(grid.X.shape, meteo.T)
+    seen = []
+    stream_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                 [tic, lambda i, ci: seen.append(i)])
+    np.testing.assert_allclose(tic.TIC, TIC)
+    assert seen == list(range(len(meteo.wd)))
+
+
+@pytest.mark.parametrize("switch_plume_rise", ['none', 'hmax', 'hx'])
+@pytest.mark.parametrize("switch_plume_type", ['none', 'ground', 'inversion'])
+def test_plume_blocks(grid, meteo, source, switch_plume_type, switch_plume_rise):
+    meteo.Ta[2] = 20.  # warmer than the exhaust: no plume rise
+    c, TIC = multi_plume(grid, meteo, source, 0.5, switch_plume_type,
+                         switch_plume_rise, L=500)
+    for block_size in [2, 4, 6]:
+        cb, TICb = multi_plume(grid, meteo, source, 0.5, switch_plume_type,
+                               switch_plume_rise, L=500, block_size=block_size)
+        np.testing.assert_allclose(cb, c, rtol=1e-12, atol=0)
+        np.testing.assert_allclose(TICb, TIC, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize("executor", ['thread', 'process'])
+def test_parallel_plume(grid, meteo, source, executor):
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    cp, TICp = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                           block_size=2, workers=2, executor=executor)
+    np.testing.assert_array_equal(cp, c)
+    np.testing.assert_array_equal(TICp, TIC)
+
+
+@pytest.mark.parametrize("E", [1, 4, 7])
+def test_dispersion_BM(E):
+    A = [0.235, 0.297, 0.418, 0.586, 0.826, 0.946, 1.043][E-1]
+    a = [0.796, 0.796, 0.796, 0.796, 0.796, 0.796, 0.698][E-1]
+    B = [0.311, 0.382, 0.520, 0.700, 0.950, 1.321, 0.819][E-1]
+    b = [0.711, 0.711, 0.711, 0.711, 0.711, 0.711, 0.669][E-1]
+    corr = (220.2 + 10)/(220.2 + 60)
+    X = np.array([-10., 0., 0.5, 10., 250., 1000.])
+    sigy, sigz = dispersion_BM(E, X, 10)
+    np.testing.assert_allclose(sigy[1:], corr*A*X[1:]**a, rtol=1e-13)
+    np.testing.assert_allclose(sigz[1:], corr*B*X[1:]**b, rtol=1e-13)
+    assert np.isnan(sigy[0]) and np.isnan(sigz[0])
+    # arrays of classes broadcast against a trailing time axis
+    sigy2, sigz2 = dispersion_BM(np.array([E, E]), X[:, None], 10)
+    np.testing.assert_array_equal(sigy2[:, 1], sigy)
+
+
+def test_reflection_series(grid):
+    X, Y, Z = grid.X, grid.Y, grid.Z
+    H, L, sigz = 80., 300., 0.1*np.abs(X) + 5.
+    g1 = np.exp(-(Z-H)**2/(2*sigz**2))
+    g2 = np.exp(-(Z+H)**2/(2*sigz**2))
+    g3 = 0
+    for im in range(10):
+        g3 = g3 + \
+            np.exp(-(Z-H-2*(im+1)*L)**2/(2*sigz**2)) + \
+            np.exp(-(Z+H+2*(im+1)*L)**2/(2*sigz**2)) + \
+            np.exp(-(Z+H-2*(im+1)*L)**2/(2*sigz**2)) + \
+            np.exp(-(Z-H+2*(im+1)*L)**2/(2*sigz**2))
+    g, n = reflection_series(Z, H, sigz, L, 'inversion', tol=0)
+    np.testing.assert_array_equal(g, g1+g2+g3)
+    g, n = reflection_series(Z, H, sigz, L, 'inversion')
+    np.testing.assert_allclose(g, g1+g2+g3, rtol=1e-11, atol=0)
+    assert n.min() == 1 and n.mean() < 2
+    g, n = reflection_series(Z, H, sigz, L, 'ground')
+    np.testing.assert_array_equal(g, g1+g2)
+    assert n == 0
+
+    info = {}
+    c = single_plume(X, Y, Z, 3., 4, 1e6, H, 10, 'inversion', L=500, info=info)
+    assert info['reflection_images'].shape == c.shape
+
+
+@pytest.mark.parametrize("switch_plume_type", ['none', 'ground', 'inversion'])
+def test_culled_plume(grid, meteo, source, switch_plume_type):
+    c, TIC = multi_plume(grid, meteo, source, 0.5, switch_plume_type, 'hx',
+                         L=300, nsig=None)
+    cc, TICc = multi_plume(grid, meteo, source, 0.5, switch_plume_type, 'hx',
+                           L=300)
+    np.testing.assert_allclose(cc, c, rtol=1e-12, atol=1e-13*c.max())
+    n, fraction = culling_report(grid, meteo, source, 0.5, switch_plume_type,
+                                 'hx', L=300)
+    assert n.shape == meteo.wd.shape
+    assert np.all(fraction < 0.6)
+    for i in range(len(n)):
+        assert np.count_nonzero(c[..., i] > 1e-10*c.max()) <= n[i]
+
+
+@pytest.mark.parametrize("L", [10., 30., 40.])
+def test_reflection_series_above_inversion(L):
+    # release and cells above the inversion, where the image terms first grow
+    Z = np.linspace(0, 200, 41)[:, None, None]
+    H, sigz = 60., np.linspace(1, 5, 21)[None, :, None]
+    g_full, n = reflection_series(Z, H, sigz, L, 'inversion', tol=0)
+    g, n = reflection_series(Z, H, sigz, L, 'inversion')
+    np.testing.assert_allclose(g, g_full, rtol=1e-11, atol=1e-12*g_full.max())
+    assert n.max() > 1
+
+
+
+def test_plume_compact_grid(grid, meteo, source):
+    sparse = create_square_centered_grid(500, 500, 200, 21, 21, 6, sparse=True)
+    for block_size in [1, 3]:
+        c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                             block_size=block_size)
+        cs, TICs = multi_plume(sparse, meteo, source, 0.5, 'inversion', 'hx',
+                               block_size=block_size)
+        np.testing.assert_array_equal(cs, c)
+        np.testing.assert_array_equal(TICs, TIC)
+
+
+def test_plume_cache(grid, meteo, source):
+    # the same meteo twice, the second time slightly off and with other releases
+    for name in ['wd', 'U', 'E', 'Ta']:
+        setattr(meteo, name, np.tile(getattr(meteo, name), 2))
+    meteo.wd[6:] += 0.01
+    meteo.U[6:] *= 1.001
+    source.Q = np.concatenate([source.Q, 2*source.Q+1])
+    cache = plume_cache(wd_step=0.5, U_step=0.01, dT_step=0.01, max_error=1e-4, check=True)
+    with pytest.warns(RuntimeWarning, match='quantization error'):
+        cc, TICc = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx', cache=cache)
+    stats = cache.stats()
+    # timestep 3 has no release and is not evaluated
+    assert (stats['misses'], stats['hits']) == (6, 5)
+    err = quantization_error(grid, meteo, source, 0.5, 'inversion', 'hx', cache)
+    assert err.max() < 0.05
+    # only the timestep that creates a bin is checked
+    assert cache.max_error < stats['max_error_seen'] <= err.max()
+
+    # the default bins are shared by ensemble members, unchecked
+    default = plume_cache()
+    meteo.sig_wd = np.full(len(meteo.wd), 3.)
+    rng = np.random.default_rng(0)
+    members = [perturb_member(meteo, source, {'wd': wind_direction_from_sigma()}, rng)
+               for k in range(8)]
+    for meteo_m, source_m in members:
+        multi_plume(grid, meteo_m, source_m, 0.5, 'inversion', 'hx', cache=default)
+    assert default.stats()['hit_rate'] > 0.1
+    assert default.max_error_seen == 0
+    for meteo_m, source_m in members:
+        err = quantization_error(grid, meteo_m, source_m, 0.5, 'inversion', 'hx', default)
+        assert err.max() < 0.2
+
+    # without quantization the fields are exact
+    exact = plume_cache(0, 0, 0)
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    ce, TICe = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx', cache=exact)
+    np.testing.assert_allclose(ce, c, rtol=1e-12, atol=1e-14*c.max())
+    np.testing.assert_allclose(TICe, TIC, rtol=1e-12)
+
+    # memory budget of two fields
+    small = plume_cache(0, 0, 0, max_memory=2*c[..., 0].nbytes)
+    multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx', cache=small)
+    assert small.stats()['entries'] == 2 and small.nbytes <= small.max_memory
+    assert small.stats()['evictions'] == small.stats()['misses']-2
+
+    with pytest.raises(ValueError):
+        multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx', workers=2, cache=cache)
+
+
+def test_unknown_plume_type(grid, meteo, source):
+    with pytest.raises(ValueError):
+        multi_plume(grid, meteo, source, 0.5, 'gaussian', 'hx')
+    with pytest.raises(ValueError):
+        single_plume(grid.X+300, grid.Y, grid.Z, 3., 4, 1., 60., 10, 'gaussian', nsig=None)
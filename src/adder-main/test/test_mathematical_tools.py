@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from mathematical_tools import (bounded_least_squares, create_square_centered_grid,
+                                grid_shape, rotate_grid, rotate_polar)
+
+
+@pytest.mark.parametrize("wd", [0., 37.5, 90., 200., 359.])
+def test_rotate_polar(grid, wd):
+    Xrot, Yrot = rotate_grid(grid.X, grid.Y, wd)
+    Xp, Yp = rotate_polar(grid, wd)
+    assert Xp.shape == grid.X.shape[:2] + (1,)
+    upwind = np.isnan(Xp[..., 0])
+    np.testing.assert_array_less(Xrot[..., 0][upwind], 1e-9)
+    np.testing.assert_allclose(Xp[..., 0][~upwind], Xrot[..., 0][~upwind],
+                               rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(Yp, Yrot[..., :1], rtol=1e-12, atol=1e-9)
+
+
+def test_rotate_polar_block(grid):
+    wd = np.array([10., 100., 190.])
+    Xp, Yp = rotate_polar(grid, wd)
+    for k in range(len(wd)):
+        Xk, Yk = rotate_polar(grid, wd[k])
+        np.testing.assert_array_equal(Xp[..., k], Xk)
+        np.testing.assert_array_equal(Yp[..., k], Yk)
+
+
+def test_compact_grid(grid):
+    sparse = create_square_centered_grid(500, 500, 200, 21, 21, 6, sparse=True)
+    assert grid_shape(sparse) == grid_shape(grid) == grid.X.shape
+    assert sparse.X.shape == (1, 21, 1) and sparse.Z.shape == (1, 1, 6)
+    dense = sparse.dense()
+    for name in ['X', 'Y', 'Z', 'r', 'cosphi', 'sinphi']:
+        np.testing.assert_array_equal(getattr(dense, name), getattr(grid, name))
+    np.testing.assert_array_equal(sparse.r, grid.r)
+    assert (sparse.dx, sparse.dy, sparse.dz) == (grid.dx, grid.dy, grid.dz)
+
+
+def test_bounded_least_squares():
+    rng = np.random.default_rng(0)
+    A = rng.normal(size=(20, 4))
+    x0 = np.array([1., -2., 0.5, 3.])
+    b = A @ x0
+    # inactive bounds give the unconstrained solution
+    x, free, status = bounded_least_squares(A, b, -10, 10)
+    assert status > 0
+    np.testing.assert_allclose(x, x0)
+    assert free.all()
+    # with bounds, compare with a brute-force search over the active sets
+    lower, upper = np.array([0., 0., 0., 0.]), np.array([np.inf, np.inf, np.inf, 2.])
+    x, free, status = bounded_least_squares(A, b, lower, upper)
+    assert np.all(x >= lower) and np.all(x <= upper)
+    best = np.inf
+    for k in range(3**4):
+        state = np.array([(k//3**i) % 3 for i in range(4)])  # 0 free, 1 lower, 2 upper
+        if np.any((state == 2) & ~np.isfinite(upper)):
+            continue
+        y = np.where(state == 1, lower, np.where(state == 2, upper, 0.))
+        f = state == 0
+        if f.any():
+            y[f] = np.linalg.lstsq(A[:, f], b - A[:, ~f] @ y[~f], rcond=None)[0]
+        if np.all(y >= lower-1e-12) and np.all(y <= upper+1e-12):
+            best = min(best, np.sum((A @ y - b)**2))
+    np.testing.assert_allclose(np.sum((A @ x - b)**2), best, rtol=1e-10)
+
+
+def test_bounded_least_squares_cycling():
+    # non-negative problem on which an active-set loop cycled and stopped at
+    # a non-optimal point (cost 1.1955 instead of 1.1152)
+    A = np.array([[0.3032303704104441, -1.103017547413925, 0.6526302495096784, 1.7185739587138245, -0.02647611153590087],
+                  [-1.48931482158964, -2.0177131855441846, 0.0742293618950078, -0.6624693897167523, -0.3386388085600406],
+                  [1.1764258098896043, 0.2398892793140529, -0.03267721622540525, -1.2376442430720096, -1.058437620439488],
+                  [-0.14752177798507796, 1.1515219229985152, -0.3989177980977025, 0.613499678116003, 0.6055165053140464]])
+    b = np.array([0.17701693548085, -1.495505294724539, -2.353968862393922, 0.0641049113458582])
+    x, free, status = bounded_least_squares(A, b)
+    assert status > 0 and np.all(x >= 0)
+    np.testing.assert_allclose(np.sum((A @ x - b)**2), 1.1152178146543608, rtol=1e-9)
+    # optimality: the gradient is zero on the free variables and points
+    # outwards at the bound
+    g = A.T @ (A @ x - b)
+    np.testing.assert_allclose(g[free], 0, atol=1e-10)
+    assert np.all(g[~free] >= -1e-10)
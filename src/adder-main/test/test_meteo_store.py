@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from meteo_store import meteo_store
+from read_inputs import read_selenium_meteo
+
+HEADER = 'Date_Time;Rotors;T8;T114;Speed;Azimuth;Elevation;AzimSigma;ElevSigma;E_dT;E_AzimSig\n'
+
+
+def write_day(path, day, offset=0.):
+    t = pd.date_range(day, periods=144, freq='10min')
+    rows = ['%s;OK;%.2f;%.2f;%.2f;%d;0.0;%.2f;0.0;%d;1\n'
+            % (ti.strftime('%Y-%m-%d %H:%M:%S'), 10+offset+k/100, 12+k/100,
+               3+k/50, (k*7) % 360, 5+k/100, 1+k % 6) for k, ti in enumerate(t)]
+    with open(path, 'w') as f:
+        f.write(HEADER+''.join(rows))
+
+
+@pytest.fixture
+def days(tmp_path):
+    files = []
+    for day in ['2021-03-02', '2021-03-01', '2021-03-03']:
+        files.append(str(tmp_path/('met%s.txt' % day.replace('-', ''))))
+        write_day(files[-1], day)
+    return files
+
+
+def test_meteo_store(tmp_path, days):
+    store = meteo_store.create(str(tmp_path/'store'), days[:2])
+    assert len(store) == 288
+    assert np.all(np.diff(store.t) > np.timedelta64(0))
+    assert store.ingest(days[:2]) == []
+    assert store.ingest(days) == [days[2]]
+
+    store = meteo_store.open(str(tmp_path/'store'))
+    assert len(store) == 3*144
+    t0, t1 = np.datetime64('2021-03-01 23:00'), np.datetime64('2021-03-03 01:00')
+    meteo = store.meteo(t0, t1)
+    assert meteo.t[0] == t0 and meteo.t[-1] == t1 and len(meteo.t) == 6+144+7
+    data = pd.concat([pd.read_csv(f, sep=';') for f in days])
+    t = pd.to_datetime(data['Date_Time']).to_numpy()
+    window = (t >= t0) & (t <= t1)
+    np.testing.assert_array_equal(np.sort(data['Speed'].to_numpy()[window]), np.sort(meteo.U))
+    assert isinstance(store.read(t0, t1)['Speed'], np.memmap)
+    assert len(store.meteo('2020-01-01', '2020-01-02').t) == 0
+
+    # a modified file replaces its rows
+    write_day(days[0], '2021-03-02', offset=100.)
+    assert sorted(store.ingest(days)) == sorted(days)
+    T8 = store.meteo('2021-03-02', '2021-03-02 23:50').T8
+    assert len(T8) == 144 and np.all(T8 >= 110)
+
+
+def test_duplicate_times(tmp_path, days):
+    write_day(str(tmp_path/'fix.txt'), '2021-03-02', offset=50.)
+    store = meteo_store.create(str(tmp_path/'store'), days+[str(tmp_path/'fix.txt')])
+    assert len(store) == 3*144
+    assert np.all(store.meteo('2021-03-02', '2021-03-02 23:50').T8 >= 60)
+
+
+def test_read_selenium_meteo():
+    data = pd.read_csv(os.path.join(os.path.dirname(__file__), '..', 'data',
+                                    'meteo', 'met20190515.txt'), sep=';')
+    meteo = read_selenium_meteo(np.datetime64('2019-05-15 01:00'),
+                                np.datetime64('2019-05-15 02:00'))
+    np.testing.assert_array_equal(meteo.U, data['Speed'].to_numpy()[6:13])
+    np.testing.assert_array_equal(meteo.E, data['E_dT'].to_numpy()[6:13])
+    np.testing.assert_allclose(meteo.Ta, meteo.T8 + (meteo.T114-meteo.T8)*52/106)
+    assert meteo.Href == 69 and meteo.T == 10
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import nuclide_library
+from nuclide_library import nuclide_library as library
+from read_inputs import read_lara
+
+SHEET = """Nuclide ; {name} 
+Element ; {element}
+Daughter(s) ; (B-) ; {daughter} ; {branching}
+Half-life (s) ; 1.0E3 ; 0.1E3
+Emissions (2 lines) sorted by decreasing intensity
+----------------------------------------
+Energy (keV) ; Ener. unc. (keV) ; Intensity (%) ; Int. unc. (%) ; Type ; Origin ; Lvl. start ; Lvl. end ; Possible coinc./Sum of
+{E} ; 0.01 ; {I} ; 0.1 ; g ; {daughter} ; 1 ; 0 ;  ; 
+32.0 ;  ; 5.0 ; 0.1 ; XKa1 ; X ;  ;  ;  ; 
+========================================
+"""
+
+
+@pytest.fixture
+def sheets(tmp_path):
+    directory = tmp_path/'nuclides'
+    directory.mkdir()
+    shutil.copy(os.path.join(nuclide_library.default_directory, 'Se-75.lara.txt'),
+                directory)
+    (directory/'Cs-137.lara.txt').write_text(SHEET.format(
+        name='Cs-137', element='Caesium', daughter='Ba-137m', branching=94.7,
+        E=283.5, I=0.00058))
+    (directory/'Ba-137m.lara.txt').write_text(SHEET.format(
+        name='Ba-137m', element='Barium', daughter='Ba-137', branching=100,
+        E=661.657, I=89.9))
+    return directory
+
+
+def test_read_lara():
+    nuclide_data = read_lara('Se-75')
+    assert nuclide_data.nuclide == 'Se-75' and nuclide_data.element == 'Selenium'
+    assert nuclide_data.Ey.shape == nuclide_data.I.shape == (21,)
+    assert nuclide_data.Ey[0] == 264.6576 and nuclide_data.I[0] == 58.75/100
+    assert nuclide_data.Ey[-1] == 821.56
+
+
+def test_library_cache(sheets, tmp_path, monkeypatch):
+    lib = library(str(sheets), str(tmp_path/'cache'))
+    assert lib.names == ['Ba-137m', 'Cs-137', 'Se-75']
+    assert len(os.listdir(tmp_path/'cache')) == 1
+
+    # loaded from the cache without parsing
+    def fail(filepath):
+        raise AssertionError(filepath)
+    monkeypatch.setattr(nuclide_library, 'parse_lara', fail)
+    cached = library(str(sheets), str(tmp_path/'cache'))
+    for name in lib.names:
+        np.testing.assert_array_equal(cached[name].Ey, lib[name].Ey)
+        np.testing.assert_array_equal(cached[name].I, lib[name].I)
+    assert cached['Cs-137'].daughters == [('Ba-137m', 94.7/100)]
+    assert cached['Cs-137'].half_life == 1.0e3
+
+    # a modified sheet invalidates the cache
+    path = sheets/'Ba-137m.lara.txt'
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns+10**9))
+    with pytest.raises(AssertionError):
+        library(str(sheets), str(tmp_path/'cache'))
+
+
+def test_lookup_daughters(sheets, tmp_path):
+    lib = library(str(sheets), str(tmp_path/'cache'))
+    cs, ba = lib.lookup(['Cs-137', 'Ba-137m'])
+    np.testing.assert_array_equal(cs.Ey, [283.5])
+    np.testing.assert_array_equal(ba.Ey, [661.657])
+    cs = lib.lookup(['Cs-137'], daughters=True)[0]
+    np.testing.assert_array_equal(cs.Ey, [283.5, 661.657])
+    np.testing.assert_allclose(cs.I, [0.0000058, 0.947*0.899])
+    assert list(cs.origin) == ['Cs-137', 'Ba-137m']
+    with pytest.raises(KeyError):
+        lib['Ba-137']
+
+
+def test_mixture(sheets, tmp_path):
+    lib = library(str(sheets), str(tmp_path/'cache'))
+    mix = lib.mixture(['Se-75', 'Ba-137m'], [0.25, 0.75])
+    se = lib['Se-75']
+    assert len(mix.Ey) == len(se.Ey) + 1
+    np.testing.assert_allclose(mix.I[:len(se.I)], 0.25*se.I)
+    np.testing.assert_allclose(mix.I[-1], 0.75*0.899)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from gamma_dosimetry import gamma_factors_many
+from gaussian_plume import multi_plume
+from precision import precision_report
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+def test_float32_plume(grid, meteo, source, nuclide_data):
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                         dtype=np.float32, block_size=2)
+    assert c.dtype == np.float32 and TIC.dtype == np.float64
+    gf_H10, gf_D = gamma_factors_many(grid, [-157.2], [-142.8], [1.0],
+                                      nuclide_data, 0.001161, 'nucl',
+                                      dtype=np.float32)
+    assert gf_H10.dtype == gf_D.dtype == np.float32
+
+
+def test_precision_report(grid, meteo, source, nuclide_data):
+    report = precision_report(grid, meteo, source, 0.5, 'inversion', 'hx',
+                              [-157.2, -262.2], [-142.8, -121.6], [1.0, 1.0],
+                              nuclide_data, 0.001161, 'nucl', L=300)
+    assert report.dtype == 'float32'
+    assert report.c < 1e-5 and report.TIC < 1e-5
+    assert np.all(report.H10 < 1e-5) and np.all(report.D < 1e-5)
+    assert report.nbytes < report.nbytes_ref
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from gamma_dosimetry import dose_rate_series, gamma_factors_many, radial_kernel
+from gaussian_plume import multi_plume
+from receptors import receptor_dose_rates, receptor_radius, receptor_support
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+def test_receptor_dose_rates(grid, meteo, source, nuclide_data):
+    gf_H10, gf_D = gamma_factors_many(grid, [-157.2, -262.2], [-142.8, -121.6],
+                                      [1.0, 1.0], nuclide_data, 0.001161, 'nucl')
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    H10, D = dose_rate_series(gf_H10, gf_D, c)
+
+    # without truncation, the result is that of the full grid
+    xq, yq, zq = [-157.2, -262.2], [-142.8, -121.6], [1.0, 1.0]
+    supports = receptor_support(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl', tol=0)
+    H10r, Dr, cells = receptor_dose_rates(grid, meteo, source, 0.5, 'inversion', 'hx',
+                                          gf_H10, gf_D, supports, block_size=2)
+    assert len(cells) == grid.X.size
+    np.testing.assert_allclose(H10r, H10, rtol=1e-12)
+    np.testing.assert_allclose(Dr, D, rtol=1e-12)
+
+    supports = receptor_support(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl', tol=1e-2)
+    H10r, Dr, cells = receptor_dose_rates(grid, meteo, source, 0.5, 'inversion', 'hx',
+                                          gf_H10, gf_D, supports)
+    assert len(cells) < grid.X.size
+    np.testing.assert_allclose(H10r, H10, rtol=0, atol=1e-3*H10.max())
+    np.testing.assert_allclose(Dr, D, rtol=0, atol=1e-3*D.max())
+
+
+def test_receptor_support(grid, nuclide_data):
+    radius = receptor_radius(nuclide_data, 0.001161, 'nucl', tol=1e-3)
+    kernel = radial_kernel(nuclide_data, 0.001161, 'nucl', 2*radius)
+    f = kernel.f/kernel.f[:, :1]
+    assert np.all(f[:, kernel.r > radius] < 1e-3)
+    assert np.any(f[:, kernel.r < radius] >= 1e-3)
+
+    # the cells within the radius of a detector
+    radius = receptor_radius(nuclide_data, 0.001161, 'nucl', tol=0.1)
+    support, = receptor_support(grid, -157.2, -142.8, 1.0, nuclide_data, 0.001161, 'nucl', tol=0.1)
+    r = np.sqrt((grid.X+157.2)**2+(grid.Y+142.8)**2+(grid.Z-1.0)**2).reshape(-1)
+    np.testing.assert_array_equal(support, np.flatnonzero(r <= radius))
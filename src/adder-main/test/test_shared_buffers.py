@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from gamma_dosimetry import gamma_factors_many
+from gaussian_plume import multi_plume
+from shared_buffers import shared_buffer
+
+pytestmark = pytest.mark.filterwarnings("ignore::RuntimeWarning")
+
+
+@pytest.mark.parametrize("kind", ['shared', 'memmap'])
+def test_multi_plume_output_buffers(tmp_path, grid, meteo, source, kind):
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    if kind == 'shared':
+        c_out = shared_buffer(c.shape)
+        TIC_out = shared_buffer(TIC.shape)
+    else:
+        c_out = np.memmap(tmp_path/'c.dat', dtype=np.float64, mode='w+',
+                          shape=c.shape)
+        TIC_out = np.memmap(tmp_path/'TIC.dat', dtype=np.float64, mode='w+',
+                            shape=TIC.shape)
+    try:
+        # twice, to check that the buffers can be reused
+        for i in range(2):
+            cp, TICp = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                                   block_size=2, workers=2, executor='process',
+                                   c_out=c_out, TIC_out=TIC_out)
+            np.testing.assert_array_equal(cp, c)
+            np.testing.assert_array_equal(TICp, TIC)
+        if kind == 'shared':
+            np.testing.assert_array_equal(c_out.array, c)
+    finally:
+        if kind == 'shared':
+            del cp, TICp
+            c_out.unlink()
+            TIC_out.unlink()
+
+
+@pytest.mark.parametrize("kind", ['array', 'memmap_view'])
+def test_multi_plume_unshared_output(tmp_path, grid, meteo, source, kind):
+    # output arrays that the process workers cannot attach to
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    if kind == 'array':
+        c_out = np.zeros(c.shape)
+    else:
+        big = np.memmap(tmp_path/'c.dat', dtype=np.float64, mode='w+',
+                        shape=(2,)+c.shape)
+        c_out = big[1]
+    cp, TICp = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx',
+                           block_size=2, workers=2, executor='process',
+                           c_out=c_out)
+    assert cp.max() > 0
+    np.testing.assert_array_equal(cp, c)
+    np.testing.assert_array_equal(c_out, c)
+    np.testing.assert_array_equal(TICp, TIC)
+
+
+def test_gamma_factors_output_buffers(grid, nuclide_data):
+    xq, yq, zq = [-157.2, -262.2], [-142.8, -121.6], [1.0, 1.0]
+    gf_H10, gf_D = gamma_factors_many(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl')
+    with shared_buffer(gf_H10.shape) as H10_out, shared_buffer(gf_D.shape) as D_out:
+        # one detector at a time into slices, as separate workers would
+        for j in range(2):
+            gamma_factors_many(grid, xq[j:j+1], yq[j:j+1], zq[j:j+1], nuclide_data,
+                               0.001161, 'nucl',
+                               out=(H10_out.array[j:j+1], D_out.array[j:j+1]))
+        np.testing.assert_array_equal(H10_out.array, gf_H10)
+        np.testing.assert_array_equal(D_out.array, gf_D)
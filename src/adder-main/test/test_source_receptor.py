@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from gamma_dosimetry import dose_rate_series, gamma_factors_many
+from gaussian_plume import multi_plume, plume_cache
+from source_receptor import (cached_source_receptor_matrix, dose_rates,
+                             invert_source_term, source_receptor_matrix)
+
+
+def detectors(grid, nuclide_data):
+    xq, yq, zq = np.array([-157.2, -262.2, -305.8]), np.array([-142.8, -121.6, 44.9]), np.ones(3)
+    return gamma_factors_many(grid, xq, yq, zq, nuclide_data, 0.001161, 'nucl')
+
+
+def test_source_receptor_matrix(grid, meteo, source, nuclide_data):
+    gf_H10, gf_D = detectors(grid, nuclide_data)
+    c, TIC = multi_plume(grid, meteo, source, 0.5, 'inversion', 'hx')
+    H10, D = dose_rate_series(gf_H10, gf_D, c)
+    M_H10, M_D = source_receptor_matrix(grid, meteo, source, 0.5, 'inversion', 'hx', gf_H10, gf_D)
+    assert M_H10.shape == (3, len(meteo.wd))
+    np.testing.assert_allclose(dose_rates(M_H10, source.Q), H10, rtol=1e-12, atol=1e-14*np.abs(H10).max())
+    np.testing.assert_allclose(dose_rates(M_D, source.Q), D, rtol=1e-12, atol=1e-14*np.abs(D).max())
+
+
+def test_cached_source_receptor_matrix(tmp_path, grid, meteo, source, nuclide_data):
+    gf_H10, gf_D = detectors(grid, nuclide_data)
+    M = source_receptor_matrix(grid, meteo, source, 0.5, 'ground', 'hx', gf_H10, gf_D)
+    first = cached_source_receptor_matrix(grid, meteo, source, 0.5, 'ground', 'hx', gf_H10, gf_D, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+    second = cached_source_receptor_matrix(grid, meteo, source, 0.5, 'ground', 'hx', gf_H10, gf_D, cache_dir=tmp_path)
+    np.testing.assert_array_equal(first[0], M[0])
+    np.testing.assert_array_equal(second[1], M[1])
+    # a plume_cache quantizes the meteo: its own entry, shared by equal bins
+    quantized = cached_source_receptor_matrix(grid, meteo, source, 0.5, 'ground', 'hx', gf_H10, gf_D,
+                                              cache_dir=tmp_path, cache=plume_cache(wd_step=5.))
+    assert len(list(tmp_path.glob('*.npy'))) == 2
+    assert not np.array_equal(quantized[0], M[0])
+    again = cached_source_receptor_matrix(grid, meteo, source, 0.5, 'ground', 'hx', gf_H10, gf_D,
+                                          cache_dir=tmp_path, cache=plume_cache(wd_step=5.))
+    np.testing.assert_array_equal(again[0], quantized[0])
+    assert len(list(tmp_path.glob('*.npy'))) == 2
+    # other meteo, other entry
+    meteo.U = meteo.U + 1
+    cached_source_receptor_matrix(grid, meteo, source, 0.5, 'ground', 'hx', gf_H10, gf_D, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('*.npy'))) == 3
+
+
+def test_invert_source_term():
+    rng = np.random.default_rng(1)
+    M = rng.uniform(0, 1e-6, (3, 6))
+    Q = np.array([8.3, 8.3, 8.3, 0., 1., 2.])*1e6
+    sig = np.array([1.05, 0.95, 0.8])
+    obs = dose_rates(M, Q)
+    fit = invert_source_term(M, obs, sig)
+    np.testing.assert_allclose(fit.Q, Q, atol=1e-6*Q.max())
+    assert fit.chi2 < 1e-12
+    assert fit.converged
+
+    # negative observations: the release rates stay non-negative
+    fit = invert_source_term(M, -obs, sig)
+    np.testing.assert_array_equal(fit.Q, 0)
+    assert fit.at_bound.all()
+
+    # constant release rate, with a missing observation
+    obs = dose_rates(M, 5e6*np.ones(6))
+    obs[1, 2] = np.nan
+    fit = invert_source_term(M, obs, sig, basis=np.ones((6, 1)))
+    np.testing.assert_allclose(fit.Q, 5e6)
+    assert np.isnan(fit.residuals[1, 2])